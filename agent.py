@@ -1,29 +1,86 @@
+import os
+import sys
 import time
 import json
+import threading
 from camera_manager import CameraManager
-from robot_controller import RobotController
+from robot_controller import RobotController, group_moves
 from recipe_llm import RecipeLLM
 from vision_llm import VisionLLM
 from llm_planner_end2end import End2EndPlanner
+from arm_scheduler import ArmScheduler
+from async_controller import AsyncRobotController
+from telemetry import TelemetryRecorder
+from recipe_rules import parse_order
+from output_validator import DEFAULT_LAYOUT
+from order_service import OrderService, ServiceBusy
+
+# 预热时预先规划的常见订单
+WARMUP_ORDERS = ["拿铁", "美式", "冰拿铁", "冰美式", "燕麦拿铁", "卡布奇诺", "摩卡"]
 
 class CoffeeAgent:
     """主控制器：协调视觉、语言模型和机械臂执行完整任务流程"""
 
-    def __init__(self):
+    def __init__(self, num_arms=1, blend_radius=0.0, telemetry_path=None, warm_up=False):
         print("🤖 正在初始化系统...")
+        start_time = time.perf_counter()
 
         # 硬件接口
         self.camera = CameraManager()
-        self.controller = RobotController()
+        self.controllers = [RobotController(robot_index=i) for i in range(num_arms)]
+        self.controller = self.controllers[0]
+        self.motion = AsyncRobotController(self.controller)  # 非阻塞指令（如回到安全位置）
+
+        # 可选：逐周期记录轨迹（每个机械臂一个会话文件）
+        self.recorders = []
+        if telemetry_path:
+            for i, controller in enumerate(self.controllers):
+                path = telemetry_path if num_arms == 1 else f"{telemetry_path}_arm{i}"
+                controller.recorder = TelemetryRecorder(path)
+                self.recorders.append(controller.recorder)
+            print(f"📼 轨迹记录已开启: {telemetry_path}")
 
-        # AI 模型
+        self.blend_radius = blend_radius  # > 0 时连续的 MOVE 融合为一条轨迹
+        self.scheduler = ArmScheduler(self.controllers, blend_radius=blend_radius) if num_arms > 1 else None
+
+        # AI 模型（SDK 和网络连接在第一次调用时才创建）
         self.brain_recipe = RecipeLLM()       # 订单 -> 配方
         self.brain_vision = VisionLLM()       # 图像 -> 坐标
         self.brain_planner = End2EndPlanner() # 配方+坐标 -> 动作
 
-        print("✅ 系统就绪！")
+        self.order_count = 0
+        self.last_layout = None  # 最近一次视觉识别的货架布局
+        self._progress = None
+        self.startup_time = time.perf_counter() - start_time
+        print(f"✅ 系统就绪！启动耗时 {self.startup_time:.2f}s")
+
+        # 预热在后台进行，不耽误接单
+        if warm_up:
+            threading.Thread(target=self.warm_up, daemon=True).start()
 
-    def run(self):
+    def warm_up(self, orders=WARMUP_ORDERS, layout=None):
+        """预热：建立模型 API 连接，并为常见订单预先填充动作计划和 IK 缓存"""
+        start_time = time.perf_counter()
+        try:
+            self.brain_planner.warm_up(self.brain_planner.model)
+        except Exception as e:
+            print(f"⚠️ 模型 API 预连接失败: {e}")
+
+        # 按最近一次识别到的布局预热；还没有识别过时用初始布局。只填充缓存，不淘汰已有计划
+        layout = layout or self.last_layout or DEFAULT_LAYOUT
+        for order in orders:
+            recipe = parse_order(order)
+            if not recipe or recipe["status"] != "success":
+                continue
+            tasks = self.brain_planner.plan_tasks(recipe["steps"], layout, update_layout=False)
+            targets = [act["pos"] for task in tasks for act in task["actions"] if act["cmd"] == "MOVE"]
+            for controller in self.controllers:
+                controller.warm_ik_cache(targets)
+
+        print(f"🔥 预热完成，耗时 {time.perf_counter() - start_time:.2f}s")
+
+    def run(self, service=None):
+        """命令行接单；传入 OrderService 时作为它的一个客户端，下单后不必等待制作完成"""
         while True:
             print("\n" + "="*50)
             user_input = input("🗣️ 请输入您的需求 (输入 'q' 退出): ")
@@ -31,23 +88,67 @@ class CoffeeAgent:
             if user_input.lower() == 'q':
                 print("👋 再见！")
                 break
-            
-            self._process_order(user_input)
+
+            if not user_input.strip():
+                continue
+
+            if service is None:
+                self.handle_order(user_input)
+                continue
+
+            try:
+                order = service.submit(user_input)
+                print(f"📝 订单 #{order.id} 已排队，可继续下单")
+            except ServiceBusy as e:
+                print(f"⏳ {e}")
+
+        if service is not None:
+            print("⏳ 正在完成剩余订单...")
+            service.stop(drain=True)
+        self.close()
+
+    def handle_order(self, user_input, progress=None):
+        """处理一个订单（带轨迹分段），progress(stage, message) 接收进度事件，成功返回 True"""
+        self.order_count += 1
+        self._progress = progress
+        for recorder in self.recorders:
+            recorder.begin_segment(f"{self.order_count}:{user_input}")
+        try:
+            return self._process_order(user_input)
+        finally:
+            self._progress = None
+            for recorder in self.recorders:
+                recorder.end_segment()
+
+    def close(self):
+        """等待机械臂空闲并关闭轨迹记录"""
+        self.motion.wait_idle()
+        for recorder in self.recorders:
+            recorder.close()
+
+    def _report(self, stage, message):
+        """向当前订单的进度回调发送事件"""
+        if self._progress:
+            self._progress(stage, message)
+
+    def _fail(self, message):
+        print(message)
+        self._report("failed", message)
+        return False
 
     def _process_order(self, user_input):
         """处理订单全流程：配方 -> 视觉 -> 规划 -> 执行"""
 
         # [1/4] 生成配方
         print(f"\n[1/4] 分析订单: {user_input} ...")
+        self._report("recipe", user_input)
         recipe_data = self.brain_recipe.generate_recipe(user_input)
 
         if not recipe_data:
-            print("❌ 无法生成配方")
-            return
+            return self._fail("❌ 无法生成配方")
 
         if recipe_data.get("status") == "reject":
-            print(f"🚫 {recipe_data.get('message')}")
-            return
+            return self._fail(f"🚫 {recipe_data.get('message')}")
 
         print(f"✅ {recipe_data['product_name']}")
         recipe_steps = recipe_data['steps']
@@ -55,14 +156,16 @@ class CoffeeAgent:
 
         # [2/4] 视觉识别和库存核对
         print(f"\n[2/4] 视觉扫描...")
+        self._report("vision", recipe_data['product_name'])
+        self.motion.wait_idle()  # 上一单的机械臂回位完成后再拍照，避免遮挡
         image_path = self.camera.capture_image()
         if not image_path:
-            return
+            return self._fail("❌ 图像捕获失败")
 
         location_map = self.brain_vision.detect_ingredients(image_path)
         if not location_map:
-            print("❌ 视觉识别失败")
-            return
+            return self._fail("❌ 视觉识别失败")
+        self.last_layout = location_map
 
         # 核对原料库存
         missing_ingredients = []
@@ -72,18 +175,23 @@ class CoffeeAgent:
                 missing_ingredients.append(needed_item)
 
         if missing_ingredients:
-            print(f"🚫 缺少原料: {missing_ingredients}")
-            return
+            return self._fail(f"🚫 缺少原料: {missing_ingredients}")
         else:
             print("✅ 库存充足")
 
+        # 用同一帧的深度图估计瓶子实际位置，修正抓取点
+        bottle_offsets = self._bottle_offsets(location_map)
+
+        if self.scheduler:
+            return self._process_multi_arm(recipe_steps, location_map, bottle_offsets)
+
         # [3/4] 动作规划
         print(f"\n[3/4] 生成运动轨迹...")
-        full_action_plan = self.brain_planner.plan_recipe(recipe_steps, location_map)
+        self._report("plan", f"{len(recipe_steps)} 种原料")
+        full_action_plan = self.brain_planner.plan_recipe(recipe_steps, location_map, bottle_offsets)
 
         if not full_action_plan:
-            print("❌ 动作规划失败")
-            return
+            return self._fail("❌ 动作规划失败")
 
         print(f"✅ 轨迹规划完成，共 {len(full_action_plan)} 步")
 
@@ -91,16 +199,64 @@ class CoffeeAgent:
         print(f"\n[4/4] 执行动作...")
         self._execute_physical_actions(full_action_plan)
         print("\n🎉 制作完成！")
+        self._report("done", recipe_data['product_name'])
+
+        # 回到安全位置（不阻塞，接单和配方生成可以同时进行）
+        self.motion.move_to([0, -0.4, 1.0], steps=100)
+        return True
+
+    def _bottle_offsets(self, location_map):
+        """把相机估计的格子偏移换算成 原料 -> [dx, dy, 0.0]（只修正水平位置）"""
+        try:
+            by_cell = self.camera.estimate_bottle_offsets()
+        except Exception as e:
+            print(f"⚠️ 瓶子位置估计失败，使用标准坐标: {e}")
+            return {}
+        return {
+            name: by_cell[tuple(grid)]
+            for name, grid in location_map.items()
+            if grid and tuple(grid) in by_cell
+        }
+
+    def _process_multi_arm(self, recipe_steps, location_map, bottle_offsets=None):
+        """多机械臂：按原料规划任务，由调度器分配并行执行"""
+        print(f"\n[3/4] 生成运动轨迹...")
+        self._report("plan", f"{len(recipe_steps)} 种原料")
+        tasks = self.brain_planner.plan_tasks(recipe_steps, location_map, bottle_offsets)
+
+        if not tasks:
+            return self._fail("❌ 动作规划失败")
 
-        # 回到安全位置
-        self.controller.move_to_smooth([0, -0.4, 1.0], steps=100)
+        print(f"✅ 轨迹规划完成，共 {len(tasks)} 个原料任务")
+
+        print(f"\n[4/4] 多臂执行...")
+        self._report("execute", f"{len(tasks)} 个原料任务")
+        ok = self.scheduler.run(tasks)
+
+        # 回到各自待命点
+        self.scheduler.home_all()
+
+        if not ok:
+            return self._fail("\n❌ 执行中断")
+        print("\n🎉 制作完成！")
+        self._report("done", f"{len(tasks)} 个原料任务")
+        return True
 
     def _execute_physical_actions(self, actions):
         """解析动作指令并执行：MOVE, GRAB, WRIST, WAIT"""
         total_steps = len(actions)
-        for i, act in enumerate(actions):
+        # 融合模式：连续的 MOVE 合并为一条不停顿的轨迹
+        for i, j, act in group_moves(actions, blend=self.blend_radius > 0):
             cmd = act.get("cmd")
+
+            if cmd == "MOVE_THROUGH":
+                print(f"   [{i+1}-{j}/{total_steps}] MOVE (融合): {act['targets']}")
+                self._report("execute", f"{j}/{total_steps} MOVE")
+                self.controller.move_through(act["targets"], steps=150, blend_radius=self.blend_radius)
+                continue
+
             print(f"   [{i+1}/{total_steps}] {cmd}: {act}")
+            self._report("execute", f"{i+1}/{total_steps} {cmd}")
 
             if cmd == "MOVE":
                 self.controller.move_to_smooth(act["pos"], steps=150)
@@ -112,5 +268,18 @@ class CoffeeAgent:
                 time.sleep(act.get("time", 1.0))
 
 if __name__ == "__main__":
-    agent = CoffeeAgent()
-    agent.run()
\ No newline at end of file
+    # 用法: python agent.py [机械臂数量] [融合半径]，机械臂数量需与 coffee_env.py 一致
+    num_arms = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    blend_radius = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    try:
+        agent = CoffeeAgent(num_arms=num_arms, blend_radius=blend_radius,
+                            telemetry_path=os.getenv("COFFEE_TELEMETRY"),
+                            warm_up=os.getenv("COFFEE_WARMUP") == "1")
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    # 订单服务：其他程序可通过 HTTP 下单，命令行输入也经由它排队
+    service = OrderService(agent, port=int(os.getenv("COFFEE_PORT", "8765")))
+    service.start()
+    agent.run(service)
\ No newline at end of file
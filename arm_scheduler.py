@@ -0,0 +1,443 @@
+import itertools
+import math
+import threading
+import time
+
+import pybullet as p
+
+from output_validator import WORK_POSE, CUP_POSE, GRID_SIZE
+from robot_controller import group_moves
+
+# 共享工作区按 x 方向划分的通道：倒水区 + 货架三列
+LANES = {"POUR": CUP_POSE[0], "COL0": -0.2, "COL1": 0.0, "COL2": 0.2}
+
+# 货架取放点（与 END2END_PROMPT 一致）
+PRE_GRASP_Y = -0.05
+GRASP_Y = 0.09
+
+
+# 从待命点出发的标准动作：倒水 + 取放每个格子的瓶子
+CELLS = [(row, col) for row in range(GRID_SIZE) for col in range(GRID_SIZE)]
+EXCURSIONS = ["POUR"] + [f"CELL{row}{col}" for row, col in CELLS]
+
+
+def shelf_poses(row, col):
+    """某个格子的预抓取点和抓取点"""
+    x, z = (col - 1) * 0.2, 0.8 + row * 0.15
+    return [x, PRE_GRASP_Y, z], [x, GRASP_Y, z]
+
+
+class SchedulerAborted(RuntimeError):
+    """某个机械臂执行失败，其余机械臂停止等待"""
+
+
+class ZoneReservations:
+    """共享区域预约表：一次性申请整组区域（不持有等待），保证不会死锁"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._owners = {}
+        self._pour_turn = 0
+        self._aborted = False
+
+    def _wait(self, predicate):
+        """等待条件成立，调度中止时抛出异常"""
+        self._cond.wait_for(lambda: self._aborted or predicate())
+        if self._aborted:
+            raise SchedulerAborted("调度已中止")
+
+    def acquire(self, arm, zones):
+        """申请一组区域，直到全部空闲才一起占用"""
+        with self._cond:
+            self._wait(lambda: all(self._owners.get(z, arm) == arm for z in zones))
+            for z in zones:
+                self._owners[z] = arm
+
+    def release(self, arm):
+        """释放该机械臂占用的全部区域"""
+        with self._cond:
+            for z in [z for z, owner in self._owners.items() if owner == arm]:
+                del self._owners[z]
+            self._cond.notify_all()
+
+    def wait_pour_turn(self, turn):
+        """按配方顺序倒料：等待轮到第 turn 个原料"""
+        with self._cond:
+            self._wait(lambda: self._pour_turn == turn)
+
+    def finish_pour(self):
+        with self._cond:
+            self._pour_turn += 1
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+
+class ArmClearance:
+    """在独立的 DIRECT 客户端中复制所有机械臂，用 IK 解检查两臂之间的最小距离
+
+    x 方向的通道只约束末端位置，不约束连杆：停在待命点的机械臂可能被另一只臂的
+    肘部或前臂扫到。这里按控制器实际会用的 IK 解（同一目标点的解会被缓存复用）
+    摆好两只臂，用 getClosestPoints 计算连杆之间的距离。
+    """
+
+    def __init__(self, controllers, samples=5):
+        import pybullet_data
+        self.controllers = controllers
+        self.samples = samples  # 每段关节插值路径上的采样数
+        self.client = p.connect(p.DIRECT)
+        p.setAdditionalSearchPath(pybullet_data.getDataPath(), physicsClientId=self.client)
+        self.bodies = []
+        for controller in controllers:
+            body = p.loadURDF("franka_panda/panda.urdf", useFixedBase=True, physicsClientId=self.client)
+            # 按质心坐标复制底座位姿，与仿真中的机械臂完全重合
+            pos, orn = p.getBasePositionAndOrientation(controller.robotId)
+            p.resetBasePositionAndOrientation(body, pos, orn, physicsClientId=self.client)
+            self.bodies.append(body)
+
+    def joints(self, arm, pos):
+        return self.controllers[arm]._solve_ik(pos)
+
+    def path(self, arm, poses, wrist=0.0):
+        """依次经过 poses 的关节插值路径（与 move_ticks 一致），wrist 为在最后一个点旋转手腕的角度"""
+        points = [self.joints(arm, pos) for pos in poses]
+        if wrist:
+            turned = list(points[-1])
+            turned[6] += wrist
+            points.append(turned)
+        path = [points[0]]
+        for start, end in zip(points, points[1:]):
+            for k in range(1, self.samples + 1):
+                t = k / self.samples
+                path.append([a + (b - a) * t for a, b in zip(start, end)])
+        return path
+
+    def _set(self, arm, joints):
+        for i in range(7):
+            p.resetJointState(self.bodies[arm], i, joints[i], physicsClientId=self.client)
+
+    def collides(self, arm_a, path_a, arm_b, path_b, clearance):
+        """两臂分别沿 path_a、path_b 运动时，是否有某一对姿态的连杆距离小于 clearance"""
+        for joints_a in path_a:
+            self._set(arm_a, joints_a)
+            for joints_b in path_b:
+                self._set(arm_b, joints_b)
+                if p.getClosestPoints(self.bodies[arm_a], self.bodies[arm_b], clearance, physicsClientId=self.client):
+                    return True
+        return False
+
+    def reached(self, arm, pos):
+        """IK 解的末端与目标点的距离"""
+        self._set(arm, self.joints(arm, pos))
+        link = p.getLinkState(self.bodies[arm], self.controllers[arm].end_effector_index,
+                              computeForwardKinematics=True, physicsClientId=self.client)
+        return sum((a - b) ** 2 for a, b in zip(link[4], pos)) ** 0.5
+
+    def close(self):
+        p.disconnect(self.client)
+
+
+class ArmScheduler:
+    """多机械臂调度器：分配原料任务，并预约货架列和倒水区避免碰撞"""
+
+    def __init__(self, controllers, lane_margin=0.1, travel_weight=5.0, move_steps=150, wrist_steps=100,
+                 blend_radius=0.0, staging_clearance=0.05, min_clearance=0.03, staging_step=0.05, staging_tries=2):
+        self.controllers = controllers
+        self.lane_margin = lane_margin
+        self.staging_clearance = staging_clearance
+        self.min_clearance = min_clearance  # 两臂连杆之间的最小距离（米）
+        self.staging_step = staging_step
+        self.staging_tries = staging_tries
+        self.travel_weight = travel_weight  # 每米横向距离折算的秒数
+        self.move_steps = move_steps
+        self.wrist_steps = wrist_steps
+        self.blend_radius = blend_radius
+        self.staging = [self._staging_pose(c) for c in controllers]
+
+        # 由连杆几何决定的约束：各机械臂在其他臂停放时能安全执行的标准动作，以及不能同时执行的动作对
+        self.allowed = [set(EXCURSIONS) for _ in controllers]
+        self.conflicts = set()
+        if len(controllers) > 1:
+            self._plan_clearance()
+        self._check_staging()
+
+    def _lane_range(self, lane):
+        x = LANES[lane]
+        return x - self.lane_margin, x + self.lane_margin
+
+    def _staging_pose(self, controller):
+        """每个机械臂在自己底座前方待命，代替共享的 Work Pose
+
+        待命点必须在所有通道之外：停着的机械臂不持有预约，
+        若待命点落在某个通道里，别的机械臂预约该通道后就会撞上它。
+        因此待命点从底座正前方沿 x 向外侧（远离中线）推到通道边界之外。
+        """
+        base = controller.base_pos or [WORK_POSE[0], WORK_POSE[1] - 0.3, 0]
+        x = base[0]
+        outward = 1 if x >= 0 else -1
+        for _ in range(len(LANES)):
+            hit = [lane for lane in LANES if self._lane_range(lane)[0] <= x <= self._lane_range(lane)[1]]
+            if not hit:
+                break
+            edges = [self._lane_range(lane)[1 if outward > 0 else 0] for lane in hit]
+            x = (max(edges) if outward > 0 else min(edges)) + outward * self.staging_clearance
+        return [round(x, 4), base[1] + 0.3, WORK_POSE[2]]
+
+    def _check_staging(self):
+        """确认每个待命点都不在任何可预约的通道内，且互不重叠"""
+        for arm, pose in enumerate(self.staging):
+            for lane in LANES:
+                lo, hi = self._lane_range(lane)
+                if lo <= pose[0] <= hi:
+                    raise ValueError(f"机械臂 {arm} 的待命点 {pose} 落在通道 {lane} 内")
+            for other in range(arm):
+                if abs(self.staging[other][0] - pose[0]) < 2 * self.staging_clearance:
+                    raise ValueError(f"机械臂 {other} 和 {arm} 的待命点过近: {self.staging[other]} / {pose}")
+
+    def _excursions(self, clearance, arm, staging):
+        """机械臂从待命点出发的各个标准动作的关节路径 {动作: 路径}"""
+        paths = {"POUR": clearance.path(arm, [staging, CUP_POSE], wrist=-math.pi / 2)}
+        for row, col in CELLS:
+            paths[f"CELL{row}{col}"] = clearance.path(arm, [staging, *shelf_poses(row, col)])
+        return paths
+
+    def _staging_candidates(self, arm):
+        """待命点候选：在通道之外的基础位置上，逐步向外、向后、向上挪（挪动少的在前）"""
+        x, y, z = self.staging[arm]
+        outward = 1 if x >= 0 else -1
+        steps = range(self.staging_tries + 1)
+        moves = sorted(((out, back, lift) for out in steps for back in steps for lift in steps), key=sum)
+        return [[round(x + outward * out * self.staging_step, 4), round(y - back * self.staging_step, 4),
+                 round(z + lift * self.staging_step, 4)] for out, back, lift in moves]
+
+    def _plan_clearance(self):
+        """用各机械臂的 IK 解和 getClosestPoints 检查连杆距离，确定待命点和动作约束
+
+        x 方向的通道只约束末端，停着的机械臂又不持有预约，所以：
+        1. 每个机械臂的待命点从候选中挑选，使其他机械臂能安全执行的标准动作最多；
+        2. 会扫到其他停放机械臂的动作不分配给该机械臂（allowed）；
+        3. 两臂同时执行会碰撞的动作对记入 conflicts，执行时额外预约，保证互斥。
+        有格子没有任何机械臂能安全完成（取放 + 倒水）时抛出 ValueError。
+        """
+        clearance = ArmClearance(self.controllers)
+        arms = range(len(self.controllers))
+        try:
+            paths = [self._excursions(clearance, arm, self.staging[arm]) for arm in arms]
+
+            def score(arm, pose):
+                """停在 pose 时其他机械臂能安全执行的动作数；倒水每个机械臂都要用，优先保证"""
+                parked = [clearance.joints(arm, pose)]
+                safe = [key for other in arms if other != arm for key, path in paths[other].items()
+                        if not clearance.collides(arm, parked, other, path, self.min_clearance)]
+                return safe.count("POUR"), len(safe)
+
+            for arm in arms:
+                reachable = [pose for pose in self._staging_candidates(arm)
+                             if clearance.reached(arm, pose) <= 2 * self.controllers[arm].ik_tolerance]
+                self.staging[arm] = max(reachable, key=lambda pose: score(arm, pose))
+                paths[arm] = self._excursions(clearance, arm, self.staging[arm])
+
+            parked = [[clearance.joints(arm, self.staging[arm])] for arm in arms]
+            for arm in arms:
+                self.allowed[arm] = {
+                    key for key, path in paths[arm].items()
+                    if not any(clearance.collides(other, parked[other], arm, path, self.min_clearance)
+                               for other in arms if other != arm)
+                }
+
+            missing = [f"CELL{row}{col}" for row, col in CELLS
+                       if not any({"POUR", f"CELL{row}{col}"} <= self.allowed[arm] for arm in arms)]
+            if missing:
+                raise ValueError(f"这些格子没有机械臂能在不碰到其他停放机械臂的情况下取放并倒水: {missing}")
+
+            for a, b in itertools.combinations(arms, 2):
+                for key_a in self.allowed[a]:
+                    for key_b in self.allowed[b]:
+                        if clearance.collides(a, paths[a][key_a], b, paths[b][key_b], self.min_clearance):
+                            self.conflicts.add(((a, key_a), (b, key_b)))
+        finally:
+            clearance.close()
+
+        for arm in arms:
+            print(f"🅿️ 机械臂 {arm} 待命点 {self.staging[arm]}，"
+                  f"可执行 {len(self.allowed[arm])}/{len(EXCURSIONS)} 个标准动作")
+
+    def _estimate_duration(self, actions):
+        """粗略估计一个任务的耗时（秒）"""
+        duration = 0.0
+        for act in actions:
+            if act["cmd"] == "MOVE":
+                duration += self.move_steps * 0.01
+            elif act["cmd"] == "WRIST":
+                duration += self.wrist_steps * 0.01
+            elif act["cmd"] == "GRAB":
+                duration += 0.7
+            elif act["cmd"] == "WAIT":
+                duration += act.get("time", 1.0)
+        return duration
+
+    def assign(self, tasks):
+        """贪心分配：选择预计完成最早且离目标列最近的机械臂"""
+        busy = [0.0] * len(self.controllers)
+        assignments = [[] for _ in self.controllers]
+
+        for index, task in enumerate(tasks):
+            col_x = (task["grid"][1] - 1) * 0.2
+            duration = self._estimate_duration(task["actions"])
+            # 只考虑取放该格子和倒水都不会扫到其他停放机械臂的机械臂
+            needed = {"POUR", "CELL{}{}".format(*task["grid"])}
+            arms = [a for a in range(len(self.controllers)) if needed <= self.allowed[a]]
+            best = min(arms, key=lambda a: busy[a] + duration + self.travel_weight * abs(self.staging[a][0] - col_x))
+            busy[best] += duration
+            assignments[best].append((index, task))
+
+        return assignments
+
+    def _is_work_move(self, act):
+        return act["cmd"] == "MOVE" and all(abs(a - b) < 1e-3 for a, b in zip(act["pos"], WORK_POSE))
+
+    def split_segments(self, actions, staging):
+        """以 Work Pose 为界切分动作：每段从待命点出发并回到待命点"""
+        segments, current = [], []
+        for act in actions:
+            if self._is_work_move(act):
+                segments.append(current + [{"cmd": "MOVE", "pos": staging}])
+                current = []
+            else:
+                current.append(act)
+        if current:
+            segments.append(current)
+        return segments
+
+    def zones_for(self, segment, staging, start=None):
+        """计算一段动作横扫过的通道；start 为出发点（默认是待命点）"""
+        xs = [a["pos"][0] for a in segment if a["cmd"] == "MOVE" and a["pos"] != staging]
+        if start is not None:
+            xs.append(start[0])
+        if not xs:
+            return set()
+        lo = min(xs + [staging[0]]) - self.lane_margin - 1e-6
+        hi = max(xs + [staging[0]]) + self.lane_margin + 1e-6
+        return {lane for lane, x in LANES.items() if lo <= x <= hi}
+
+    def excursion_of(self, segment, tol=0.1):
+        """判断一段动作对应哪个标准动作：含手腕旋转为倒水，否则按 MOVE 的 x/z 找最近的格子"""
+        if any(a["cmd"] == "WRIST" for a in segment):
+            return "POUR"
+        for act in segment:
+            if act["cmd"] != "MOVE":
+                continue
+            x, _, z = act["pos"]
+            row, col = min(CELLS, key=lambda cell: abs(x - shelf_poses(*cell)[0][0]) + abs(z - shelf_poses(*cell)[0][2]))
+            pre, _ = shelf_poses(row, col)
+            if abs(x - pre[0]) < tol and abs(z - pre[2]) < tol:
+                return f"CELL{row}{col}"
+        return None
+
+    def conflict_zones(self, arm, segment):
+        """与这段动作不能同时执行的动作对，各用一个共享区域名表示，双方都要预约"""
+        key = self.excursion_of(segment)
+        return {f"{a}.{key_a}|{b}.{key_b}" for (a, key_a), (b, key_b) in self.conflicts
+                if (a, key_a) == (arm, key) or (b, key_b) == (arm, key)}
+
+    def _execute(self, arm, act):
+        """执行单条动作指令"""
+        controller = self.controllers[arm]
+        cmd = act.get("cmd")
+        print(f"   [臂{arm}] {cmd}: {act}")
+
+        if cmd == "MOVE":
+            controller.move_to_smooth(act["pos"], steps=self.move_steps)
+        elif cmd == "GRAB":
+            controller.grab(act["width"])
+        elif cmd == "WRIST":
+            controller.rotate_wrist(act["angle"], steps=self.wrist_steps)
+        elif cmd == "WAIT":
+            time.sleep(act.get("time", 1.0))
+
+    def _execute_segment(self, arm, segment):
+        """执行一段动作；开启融合时连续的 MOVE 合并为一条轨迹"""
+        for _, _, act in group_moves(segment, blend=self.blend_radius > 0):
+            if act["cmd"] == "MOVE_THROUGH":
+                print(f"   [臂{arm}] MOVE (融合): {act['targets']}")
+                self.controllers[arm].move_through(act["targets"], steps=self.move_steps,
+                                                   blend_radius=self.blend_radius)
+            else:
+                self._execute(arm, act)
+
+    def _run_arm(self, arm, assigned, reservations, errors):
+        """单个机械臂的工作线程"""
+        staging = self.staging[arm]
+        try:
+            for index, task in assigned:
+                poured = False
+                for segment in self.split_segments(task["actions"], staging):
+                    is_pour = any(a["cmd"] == "WRIST" for a in segment)
+                    if is_pour and not poured:
+                        reservations.wait_pour_turn(index)
+
+                    reservations.acquire(arm, self.zones_for(segment, staging) | self.conflict_zones(arm, segment))
+                    try:
+                        self._execute_segment(arm, segment)
+                    finally:
+                        reservations.release(arm)
+
+                    if is_pour and not poured:
+                        poured = True
+                        reservations.finish_pour()
+
+                # 没有倒料动作的任务也要让出轮次
+                if not poured:
+                    reservations.wait_pour_turn(index)
+                    reservations.finish_pour()
+        except SchedulerAborted:
+            pass
+        except Exception as e:
+            print(f"❌ 机械臂 {arm} 执行失败: {e}")
+            errors.append(e)
+            reservations.abort()
+
+    def _park(self, arm, reservations):
+        """从当前位置回到待命点，途经的通道同样要预约（如从初始姿态出发的第一段移动）"""
+        controller = self.controllers[arm]
+        start = controller.get_end_effector_pos()
+        if max(abs(a - b) for a, b in zip(start, self.staging[arm])) < 1e-2:
+            return
+        move = {"cmd": "MOVE", "pos": self.staging[arm]}
+        reservations.acquire(arm, self.zones_for([move], self.staging[arm], start=start))
+        try:
+            controller.move_to_smooth(self.staging[arm], steps=100)
+        finally:
+            reservations.release(arm)
+
+    def run(self, tasks):
+        """并行执行所有原料任务，全部成功返回 True"""
+        reservations = ZoneReservations()
+        errors = []
+        threads = []
+
+        # 不在待命点的机械臂（如刚启动时的初始姿态）可能停在某个通道里，开工前先依次归位
+        for arm in range(len(self.controllers)):
+            self._park(arm, reservations)
+
+        for arm, assigned in enumerate(self.assign(tasks)):
+            if not assigned:
+                continue
+            print(f"🦾 机械臂 {arm}: {[task['ingredient'] for _, task in assigned]}")
+            t = threading.Thread(target=self._run_arm, args=(arm, assigned, reservations, errors))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+        return not errors
+
+    def home_all(self):
+        """所有机械臂依次回到各自待命点"""
+        reservations = ZoneReservations()
+        for arm in range(len(self.controllers)):
+            self._park(arm, reservations)
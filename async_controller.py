@@ -0,0 +1,243 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from robot_controller import group_moves
+
+
+class MotionCancelled(Exception):
+    """动作在执行中被取消或被抢占"""
+
+
+class _Command:
+    """控制线程中排队的一条动作指令"""
+
+    def __init__(self, name, make_ticks):
+        self.name = name
+        self.make_ticks = make_ticks
+        self.ticks = None
+        self.future = Future()
+        self.cancel_requested = False
+
+
+class AsyncRobotController:
+    """非阻塞机械臂接口：指令进入队列，由固定频率的控制线程逐周期执行
+
+    每条指令立即返回 concurrent.futures.Future；在 asyncio 中可用
+    `await asyncio.wrap_future(future)` 等待。
+    """
+
+    def __init__(self, controller, rate_hz=100):
+        self.controller = controller
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.tick_count = 0
+
+        self._queue = deque()
+        self._current = None
+        self._running = True
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._control_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # ---------- 提交指令 ----------
+
+    def submit(self, name, make_ticks, preempt=False):
+        """提交一个动作生成器工厂；preempt=True 时取消当前及排队的动作并立即执行"""
+        cmd = _Command(name, make_ticks)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("控制线程已停止")
+            if preempt:
+                self._cancel_all_locked()
+                self._queue.appendleft(cmd)
+            else:
+                self._queue.append(cmd)
+            self._cond.notify_all()
+        return cmd.future
+
+    def move_to(self, target_pos, steps=100, preempt=False):
+        return self.submit("MOVE", lambda: self.controller.move_ticks(target_pos, steps), preempt)
+
+    def move_through(self, targets, steps=150, blend_radius=0.05, preempt=False):
+        return self.submit("MOVE", lambda: self.controller.move_through_ticks(targets, steps, blend_radius), preempt)
+
+    def grab(self, width=0.0, steps=50, preempt=False):
+        settle_steps = round(0.2 * self.rate_hz)
+        return self.submit("GRAB", lambda: self.controller.grab_ticks(width, steps, settle_steps), preempt)
+
+    def rotate_wrist(self, angle_deg, steps=100, preempt=False):
+        return self.submit("WRIST", lambda: self.controller.rotate_wrist_ticks(angle_deg, steps), preempt)
+
+    def wait(self, seconds, preempt=False):
+        def ticks():
+            for _ in range(round(seconds * self.rate_hz)):
+                yield
+        return self.submit("WAIT", ticks, preempt)
+
+    def submit_actions(self, actions, move_steps=150, wrist_steps=100, blend_radius=0.0):
+        """批量提交 MOVE/GRAB/WRIST/WAIT 动作，返回与之对应的 Future 列表"""
+        futures = []
+        # 融合模式：连续的 MOVE 合并为一条轨迹
+        for _, _, act in group_moves(actions, blend=blend_radius > 0):
+            cmd = act.get("cmd")
+            if cmd == "MOVE_THROUGH":
+                futures.append(self.move_through(act["targets"], move_steps, blend_radius))
+            elif cmd == "MOVE":
+                futures.append(self.move_to(act["pos"], move_steps))
+            elif cmd == "GRAB":
+                futures.append(self.grab(act["width"]))
+            elif cmd == "WRIST":
+                futures.append(self.rotate_wrist(act["angle"], wrist_steps))
+            elif cmd == "WAIT":
+                futures.append(self.wait(act.get("time", 1.0)))
+        return futures
+
+    # ---------- 状态与取消 ----------
+
+    def status(self):
+        """返回当前状态：state / current / queued / ticks / joints"""
+        with self._cond:
+            if not self._running:
+                state = "stopped"
+            elif self._current is not None or self._queue:
+                state = "running"
+            else:
+                state = "idle"
+            return {
+                "state": state,
+                "current": self._current.name if self._current else None,
+                "queued": [cmd.name for cmd in self._queue],
+                "ticks": self.tick_count,
+                "joints": self.controller.get_current_joint_angles(),
+            }
+
+    def cancel(self, future):
+        """取消一条指令：排队中的直接移除，执行中的在下一个周期停住"""
+        with self._cond:
+            if self._current is not None and self._current.future is future:
+                self._current.cancel_requested = True
+                self._cond.notify_all()
+                return True
+            for cmd in self._queue:
+                if cmd.future is future:
+                    self._queue.remove(cmd)
+                    cmd.future.cancel()
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    def _cancel_all_locked(self):
+        while self._queue:
+            self._queue.popleft().future.cancel()
+        if self._current is not None:
+            self._current.cancel_requested = True
+
+    def cancel_all(self):
+        """取消当前动作和所有排队动作，机械臂原地停住"""
+        with self._cond:
+            self._cancel_all_locked()
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """阻塞直到所有指令执行完毕，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._current is None and not self._queue, timeout)
+
+    def shutdown(self, cancel=True):
+        """停止控制线程"""
+        with self._cond:
+            if cancel:
+                self._cancel_all_locked()
+            else:
+                self._cond.wait_for(lambda: self._current is None and not self._queue)
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+
+    # ---------- 控制线程 ----------
+
+    def _next_command(self):
+        """取出下一条未被取消的指令，没有则等待；停止时返回 None"""
+        with self._cond:
+            while self._running:
+                while self._queue:
+                    cmd = self._queue.popleft()
+                    if cmd.future.set_running_or_notify_cancel():
+                        self._current = cmd
+                        return cmd
+                self._cond.notify_all()
+                self._cond.wait()
+        return None
+
+    def _finish(self, cmd, error=None):
+        with self._cond:
+            self._current = None
+            if error is None:
+                cmd.future.set_result(True)
+            else:
+                cmd.future.set_exception(error)
+            self._cond.notify_all()
+
+    def _control_loop(self):
+        """固定频率的控制循环：每个周期推进当前动作一步"""
+        cmd = None
+        next_tick = time.monotonic()
+        while True:
+            if cmd is None:
+                cmd = self._next_command()
+                if cmd is None:
+                    break
+                next_tick = time.monotonic()
+
+            if cmd.cancel_requested:
+                if cmd.ticks is not None:
+                    cmd.ticks.close()
+                self.controller.hold()
+                self._finish(cmd, MotionCancelled(f"{cmd.name} 已取消"))
+                cmd = None
+                continue
+
+            try:
+                if cmd.ticks is None:
+                    cmd.ticks = cmd.make_ticks()
+                next(cmd.ticks)
+            except StopIteration:
+                self._finish(cmd)
+                cmd = None
+                continue
+            except Exception as e:
+                self._finish(cmd, e)
+                cmd = None
+                continue
+
+            self.controller.record_tick()
+            self.tick_count += 1
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()  # 落后时不追赶，避免突发连发
+
+
+if __name__ == "__main__":
+    from robot_controller import RobotController
+
+    motion = AsyncRobotController(RobotController())
+
+    print(">>> 测试：非阻塞移动")
+    f1 = motion.move_to([0, -0.2, 1.0], steps=150)
+    f2 = motion.move_to([0.2, -0.05, 0.8], steps=150)
+    print(motion.status())
+
+    f1.result()
+    print(">>> 第一段完成，抢占第二段并回到工作点")
+    motion.move_to([0, -0.2, 1.0], steps=100, preempt=True).result()
+    print(f"第二段: {'已取消' if f2.cancelled() or f2.exception() else '完成'}")
+
+    motion.shutdown()
+    print(">>> 测试结束")
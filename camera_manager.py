@@ -1,16 +1,30 @@
 import pybullet as p
-import matplotlib.pyplot as plt
 import numpy as np
 import math
 
+# 货架几何（与 coffee_env.py 一致）：瓶子 5x5x10cm，放在 y=0.1 的三层货架上
+BOTTLE_SIZE = [0.05, 0.05, 0.1]
+SHELF_Y = 0.1
+SHELF_TOP_Z = 0.76      # 第一层货架板上表面
+SHELF_STEP = 0.15
+COL_STEP = 0.2
+
+
+def nominal_bottle_center(row, col):
+    """瓶子在标准摆放下（落稳后）的中心坐标"""
+    return [(col - 1) * COL_STEP, SHELF_Y, SHELF_TOP_Z + row * SHELF_STEP + BOTTLE_SIZE[2] / 2]
+
+
 class CameraManager:
     """虚拟相机：在 PyBullet 仿真中捕获 RGB 图像"""
 
-    def __init__(self, save_path="captured_scene.png"):
+    def __init__(self, save_path="captured_scene.png", resolution=640):
         self.save_path = save_path
+        self.resolution = resolution
         self.camera_pos = [0, -0.5, 1.3]
         self.target_pos = [0, math.pi, 0]
         self.up_vector = [0, 0, 1]
+        self.last_capture = None  # 最近一次的深度图、分割图和相机矩阵
 
     def capture_image(self):
         """拍摄并保存图片，返回图片路径"""
@@ -30,19 +44,29 @@ class CameraManager:
 
             print("📷 正在捕获图像...")
             width, height, rgbImg, depthImg, segImg = p.getCameraImage(
-                width=640,
-                height=640,
+                width=self.resolution,
+                height=self.resolution,
                 viewMatrix=view_matrix,
                 projectionMatrix=proj_matrix,
                 renderer=p.ER_BULLET_HARDWARE_OPENGL
             )
 
+            # 保留深度信息，供瓶子位置估计使用
+            self.last_capture = {
+                "width": width, "height": height,
+                "depth": np.reshape(depthImg, (height, width)),
+                "seg": np.reshape(segImg, (height, width)),
+                "view": view_matrix, "proj": proj_matrix,
+            }
+
             # 处理图像
             rgb_array = np.array(rgbImg, dtype=np.uint8)
             rgb_array = rgb_array.reshape((height, width, 4))[:, :, :3]
+            self.last_capture["rgb"] = rgb_array
 
-            # 保存
-            plt.imsave(self.save_path, rgb_array)
+            # 保存（matplotlib 较重，用到时才导入）
+            from matplotlib import image as mpimg
+            mpimg.imsave(self.save_path, rgb_array)
             print(f"✅ 图像已保存至: {self.save_path}")
 
             return self.save_path
@@ -51,6 +75,97 @@ class CameraManager:
             print(f"❌ 捕获失败: {e}")
             return None
 
+    def project(self, points):
+        """把世界坐标点投影到最近一次拍摄的图像上，返回 N x 2 像素坐标 (u, v)"""
+        cap = self.last_capture
+        view = np.array(cap["view"]).reshape(4, 4, order="F")
+        proj = np.array(cap["proj"]).reshape(4, 4, order="F")
+        pts = np.hstack([np.asarray(points, dtype=float), np.ones((len(points), 1))])
+        clip = pts @ (proj @ view).T
+        ndc = clip[:, :2] / clip[:, 3:4]
+        return np.stack([(ndc[:, 0] + 1) / 2 * cap["width"], (1 - ndc[:, 1]) / 2 * cap["height"]], axis=-1)
+
+    def point_cloud(self, stride=2):
+        """将最近一次的深度图反投影为世界坐标点云，返回 (N x 3 点, N 个物体 ID)"""
+        cap = self.last_capture
+        if cap is None:
+            return np.zeros((0, 3)), np.zeros(0, dtype=int)
+
+        depth = cap["depth"][::stride, ::stride]
+        seg = cap["seg"][::stride, ::stride]
+        rows, cols = np.indices(depth.shape)
+        u = cols * stride + 0.5
+        v = rows * stride + 0.5
+
+        # 像素 -> NDC -> 世界坐标（PyBullet 矩阵为列主序）
+        ndc = np.stack([
+            2.0 * u / cap["width"] - 1.0,
+            1.0 - 2.0 * v / cap["height"],
+            2.0 * depth - 1.0,
+            np.ones_like(depth),
+        ], axis=-1).reshape(-1, 4)
+        view = np.array(cap["view"]).reshape(4, 4, order="F")
+        proj = np.array(cap["proj"]).reshape(4, 4, order="F")
+        world = ndc @ np.linalg.inv(proj @ view).T
+        points = world[:, :3] / world[:, 3:4]
+
+        valid = depth.reshape(-1) < 1.0  # 1.0 为远平面（背景）
+        return points[valid], seg.reshape(-1)[valid]
+
+    def _bottle_ids(self, object_ids):
+        """从分割图中挑出瓶子形状的物体"""
+        ids = []
+        for uid in np.unique(object_ids):
+            if uid < 0:
+                continue
+            # 按外观形状判断：能被拍到的物体都有外观，而相机标记等物体没有碰撞体，查询碰撞形状会失败
+            shapes = [s for s in p.getVisualShapeData(int(uid)) if s[1] == -1]
+            if shapes and shapes[0][2] == p.GEOM_BOX and np.allclose(shapes[0][3], BOTTLE_SIZE, atol=1e-3):
+                ids.append(int(uid))
+        return ids
+
+    def estimate_bottle_offsets(self, min_points=20, max_offset=0.08):
+        """根据深度点云估计每个货架格子里瓶子的实际位置
+
+        返回 {(row, col): [dx, dy, 0.0]}，为实际中心相对标准位置的水平偏移；
+        点太少或偏移过大的格子不返回，规划时沿用标准坐标。
+        瓶子总是立在已知高度的货架板上，而瓶子靠后时顶面会被上层货架挡住、
+        使 z 估计偏低，所以 z 只用于判断所在格子，不作为偏移输出。
+        """
+        points, object_ids = self.point_cloud()
+        if len(points) == 0:
+            return {}
+
+        object_ids = object_ids & ((1 << 24) - 1)
+        half_w, half_h = BOTTLE_SIZE[0] / 2, BOTTLE_SIZE[2] / 2
+        offsets = {}
+
+        for uid in self._bottle_ids(object_ids):
+            pts = points[object_ids == uid]
+            if len(pts) < min_points:
+                continue
+
+            # 相机从前上方看：x 取左右边缘中点，y 取前表面，z 取顶面
+            x_lo, x_hi = np.percentile(pts[:, 0], [2, 98])
+            center = np.array([
+                (x_lo + x_hi) / 2,
+                np.percentile(pts[:, 1], 2) + half_w,
+                np.percentile(pts[:, 2], 98) - half_h,
+            ])
+
+            # 归到最近的货架格子
+            cells = [(r, c) for r in range(3) for c in range(3)]
+            cell = min(cells, key=lambda rc: np.linalg.norm(center - nominal_bottle_center(*rc)))
+            offset = center - nominal_bottle_center(*cell)
+            offset[2] = 0.0
+            if np.abs(offset).max() <= max_offset:
+                offsets[cell] = [round(float(v), 4) for v in offset]
+
+        return offsets
+
+
 if __name__ == '__main__':
     cam = CameraManager()
-    cam.capture_image()
\ No newline at end of file
+    if cam.capture_image():
+        for cell, offset in sorted(cam.estimate_bottle_offsets().items()):
+            print(f"格子 {list(cell)}: 偏移 {offset}")
\ No newline at end of file
@@ -2,23 +2,38 @@ import pybullet as p
 import pybullet_data
 import time
 import threading
+import sys
+import math
+
+# 各机械臂底座位置和朝向 (x, y, yaw)，共享同一个货架和咖啡杯
+# Panda 默认朝 +x，初始姿态末端前伸约 0.48m，朝 +x 会伸进相邻机械臂；
+# 因此都转向货架 (+y)，并略微偏向中间，保证两侧货架列和倒水点都能精确到达
+ARM_BASES = [[-0.3, -0.65, math.pi / 2 - 0.15], [0.3, -0.65, math.pi / 2 + 0.15]]
+
+# 初始姿态下相邻机械臂之间的最小距离（米）
+ARM_CLEARANCE = 0.05
+HOME_JOINTS = [0.0, -0.24, 0.0, -2.0, 0.0, 1.8, 0.8]
 
 class CoffeeShopServer:
     """PyBullet 仿真环境：咖啡厅场景与机械臂"""
 
-    def __init__(self):
-        self.connection_mode = p.GUI_SERVER
+    def __init__(self, num_arms=1, headless=False):
+        self.num_arms = max(1, min(num_arms, len(ARM_BASES)))
+        self.headless = headless  # 无窗口模式：用于基准测试等离线场景，不启动键盘监听
+        self.connection_mode = p.DIRECT if headless else p.GUI_SERVER
         p.connect(self.connection_mode)
 
         p.setAdditionalSearchPath(pybullet_data.getDataPath())
         p.setGravity(0, 0, -9.8)
-        p.resetDebugVisualizerCamera(
-            cameraDistance=1.8, cameraYaw=0, cameraPitch=-40,
-            cameraTargetPosition=[0, -0.2, 0.6]
-        )
+        if not headless:
+            p.resetDebugVisualizerCamera(
+                cameraDistance=1.8, cameraYaw=0, cameraPitch=-40,
+                cameraTargetPosition=[0, -0.2, 0.6]
+            )
         p.loadURDF("plane.urdf")
 
         self.robotId = None
+        self.robot_ids = []
         self.bottle_records = []  # 存储瓶子信息
 
         self._create_scene()
@@ -26,9 +41,10 @@ class CoffeeShopServer:
 
         # 启动键盘监听线程
         self.running = True
-        self.input_thread = threading.Thread(target=self._console_input_loop)
-        self.input_thread.daemon = True
-        self.input_thread.start()
+        if not headless:
+            self.input_thread = threading.Thread(target=self._console_input_loop)
+            self.input_thread.daemon = True
+            self.input_thread.start()
 
     def _create_scene(self):
         """创建吧台、货架、原料瓶、咖啡杯和机械臂"""
@@ -95,6 +111,7 @@ class CoffeeShopServer:
                 "id": uid,
                 "init_pos": [pos_x, pos_y, pos_z],
                 "init_orn": [0, 0, 0, 1],
+                "cell": [item["row"], item["col"]],
                 "name": item["text"]
             })
 
@@ -107,16 +124,33 @@ class CoffeeShopServer:
         )
 
         # 机械臂
-        robot_start_pos = [-0.3, -0.65, table_h]
-        robot_start_orn = p.getQuaternionFromEuler([0, 0, 0])
-        self.robotId = p.loadURDF("franka_panda/panda.urdf", robot_start_pos, robot_start_orn, useFixedBase=True)
-
-        # 设置机械臂初始姿态
-        home_joints = [0.0, -0.24, 0.0, -2.0, 0.0, 1.8, 0.8]
-        for i in range(7):
-            p.resetJointState(self.robotId, i, home_joints[i])
-        p.resetJointState(self.robotId, 9, 0.04)
-        p.resetJointState(self.robotId, 10, 0.04)
+        self.robot_ids = []
+        for base_x, base_y, base_yaw in ARM_BASES[:self.num_arms]:
+            robot_start_orn = p.getQuaternionFromEuler([0, 0, base_yaw])
+            robot_id = p.loadURDF("franka_panda/panda.urdf", [base_x, base_y, table_h], robot_start_orn, useFixedBase=True)
+
+            # 设置机械臂初始姿态
+            for i in range(7):
+                p.resetJointState(robot_id, i, HOME_JOINTS[i])
+            p.resetJointState(robot_id, 9, 0.04)
+            p.resetJointState(robot_id, 10, 0.04)
+            self.robot_ids.append(robot_id)
+
+        self.robotId = self.robot_ids[0]
+
+        overlaps = self._arm_overlaps()
+        if overlaps:
+            raise ValueError(f"机械臂初始姿态间距不足 {ARM_CLEARANCE}m: {overlaps}")
+
+    def _arm_overlaps(self):
+        """检查各机械臂当前姿态两两之间的最小距离，返回 [(臂 a, 臂 b, 距离)]"""
+        overlaps = []
+        for a in range(len(self.robot_ids)):
+            for b in range(a + 1, len(self.robot_ids)):
+                points = p.getClosestPoints(self.robot_ids[a], self.robot_ids[b], ARM_CLEARANCE)
+                if points:
+                    overlaps.append((a, b, round(min(pt[8] for pt in points), 3)))
+        return overlaps
 
     def _create_camera(self):
         """创建虚拟相机标记"""
@@ -136,17 +170,20 @@ class CoffeeShopServer:
             p.resetBasePositionAndOrientation(record["id"], record["init_pos"], [0, 0, 0, 1])
 
         # 重置机械臂
-        home_joints = [0.0, -0.24, 0.0, -2.0, 0.0, 1.8, 0.8]
-        for i in range(7):
-            p.resetJointState(self.robotId, i, home_joints[i])
-            p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=home_joints[i], force=200)
-
-        # 重置夹爪
-        p.resetJointState(self.robotId, 9, 0.04)
-        p.resetJointState(self.robotId, 10, 0.04)
-        p.setJointMotorControl2(self.robotId, 9, p.POSITION_CONTROL, targetPosition=0.04, force=200)
-        p.setJointMotorControl2(self.robotId, 10, p.POSITION_CONTROL, targetPosition=0.04, force=200)
-
+        for robot_id in self.robot_ids:
+            for i in range(7):
+                p.resetJointState(robot_id, i, HOME_JOINTS[i])
+                p.setJointMotorControl2(robot_id, i, p.POSITION_CONTROL, targetPosition=HOME_JOINTS[i], force=200)
+
+            # 重置夹爪
+            p.resetJointState(robot_id, 9, 0.04)
+            p.resetJointState(robot_id, 10, 0.04)
+            p.setJointMotorControl2(robot_id, 9, p.POSITION_CONTROL, targetPosition=0.04, force=200)
+            p.setJointMotorControl2(robot_id, 10, p.POSITION_CONTROL, targetPosition=0.04, force=200)
+
+        overlaps = self._arm_overlaps()
+        if overlaps:
+            print(f"⚠️ 重置后机械臂间距不足 {ARM_CLEARANCE}m: {overlaps}")
         print(">>> 重置完成")
 
     def swap_bottles(self, idx1, idx2):
@@ -167,6 +204,19 @@ class CoffeeShopServer:
         p.resetBasePositionAndOrientation(id2, pos1, orn2)
         print(">>> 交换完成")
 
+    def apply_layout(self, layout, settle_steps=120):
+        """按 {原料: [row, col]} 重新摆放所有瓶子（与交换瓶子相同的方式），返回实际布局"""
+        cell_pos = {tuple(r["cell"]): r["init_pos"] for r in self.bottle_records}
+        for record in self.bottle_records:
+            cell = tuple(layout.get(record["name"], record["cell"]))
+            p.resetBasePositionAndOrientation(record["id"], cell_pos[cell], record["init_orn"])
+            p.resetBaseVelocity(record["id"], [0, 0, 0], [0, 0, 0])
+
+        # 让瓶子落稳再拍照
+        for _ in range(settle_steps):
+            p.stepSimulation()
+        return {r["name"]: list(layout.get(r["name"], r["cell"])) for r in self.bottle_records}
+
     def _console_input_loop(self):
         """键盘监听循环：处理场景重置和瓶子交换指令"""
         print("\n" + "="*50)
@@ -204,5 +254,7 @@ class CoffeeShopServer:
             print("程序退出")
 
 if __name__ == "__main__":
-    server = CoffeeShopServer()
+    # 用法: python coffee_env.py [机械臂数量]
+    num_arms = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    server = CoffeeShopServer(num_arms=num_arms)
     server.run()
\ No newline at end of file
@@ -1,10 +1,9 @@
-import os
 import json
-import re
-from zai import ZhipuAiClient
-from dotenv import load_dotenv
-
-load_dotenv()
+import hashlib
+from model_client import ModelBackend, get_api_key
+from output_validator import OutputValidationError, parse_json, validate_actions, build_reask_prompt
+from plan_cache import PlanCache
+from request_coalescer import RequestCoalescer
 
 # 核心 Prompt：纯粹的坐标计算与逻辑
 END2END_PROMPT = """
@@ -55,49 +54,130 @@ END2END_PROMPT = """
 ]
 """
 
-class End2EndPlanner:
-    """运动规划器：基于 LLM 生成机械臂动作序列"""
+# 小于该值的位置偏差视为测量噪声，不修正抓取点
+GRASP_DEADBAND = 0.005
+
+
+def refine_grasp_actions(actions, grid, offset, tol=0.02):
+    """把抓取/放回瓶子的 MOVE 按实测偏移修正 x/y，其余动作保持不变
+
+    瓶子立在已知高度的货架上，z 始终沿用标准值。
+    瓶子相关的 MOVE 满足 x = (col-1)*0.2、z = 0.8 + row*0.15（预抓取点和抓取点都算），
+    其它固定点（Work Pose、Cup Pose）不受影响。
+    """
+    if not offset or max(abs(d) for d in offset[:2]) < GRASP_DEADBAND:
+        return actions
+    row, col = grid
+    target_x, target_z = (col - 1) * 0.2, 0.8 + row * 0.15
+
+    refined = []
+    for act in actions:
+        if act["cmd"] == "MOVE" and abs(act["pos"][0] - target_x) < tol and abs(act["pos"][2] - target_z) < tol:
+            x, y, z = act["pos"]
+            act = dict(act, pos=[round(x + offset[0], 4), round(y + offset[1], 4), z])
+        refined.append(act)
+    return refined
+
 
-    def __init__(self):
-        self.api_key = os.getenv("ZHIPUAI_API_KEY")
-        self.client = ZhipuAiClient(api_key=self.api_key)
+class End2EndPlanner(ModelBackend):
+    """运动规划器：基于 LLM 生成机械臂动作序列"""
 
-    def _clean_json(self, text):
-        """清理 LLM 返回的 JSON 格式"""
-        text = re.sub(r"```json|```", "", text)
-        start = text.find('[')
-        end = text.rfind(']')
-        return text[start:end+1] if start != -1 else "[]"
+    def __init__(self, cache_size=64, wait_timeout=60):
+        self.api_key = get_api_key()
+        self.model = "glm-4.5-flash"
+
+        # 同样的配方 + 同样的货架布局 -> 同样的动作计划
+        self.cache = PlanCache(max_entries=cache_size)
+        self.config_key = {"model": self.model, "prompt": hashlib.md5(END2END_PROMPT.encode("utf-8")).hexdigest()}
+
+        # 缓存只能命中已完成的计划；同时进行的相同规划（如预热和订单撞在一起）在这里合并
+        self.coalescer = RequestCoalescer(timeout=wait_timeout)
+
+    def _chat(self, messages):
+        """调用 LLM 并返回原始文本"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.01,
+            timeout=30
+        )
+        return response.choices[0].message.content
+
+    def _check(self, content):
+        """本地修复并校验动作序列，返回 (动作列表, 错误列表)"""
+        try:
+            return validate_actions(parse_json(content, "["))
+        except OutputValidationError as e:
+            return [], e.errors
 
     def plan_ingredient(self, name, amount, grid):
         """为单个原料生成完整动作序列"""
-        user_input = json.dumps({
-            "target": name,
-            "grid": grid,
-            "amount_ml": amount
-        })
-
         print(f"🤖 规划动作: {name} (Grid {grid})...")
 
         try:
-            response = self.client.chat.completions.create(
-                model="glm-4.5-flash",
-                messages=[
-                    {"role": "system", "content": END2END_PROMPT},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=0.01,
-                timeout=30
-            )
-            content = self._clean_json(response.choices[0].message.content)
-            return json.loads(content)
+            key = self.coalescer.make_key(name, amount, grid, self.config_key)
+            return self.coalescer.run(key, lambda: self._ask_actions(name, amount, grid))
+        except OutputValidationError as e:
+            print(f"❌ 规划失败: {e.errors}")
+            return []
+        except TimeoutError:
+            print(f"❌ 规划失败: 等待 {name} 的动作计划超时")
+            return []
         except Exception as e:
             print(f"❌ 规划失败: {e}")
             return []
 
-    def plan_recipe(self, recipe, location_map):
-        """根据配方和位置地图生成完整动作计划"""
-        full_plan = []
+    def _ask_actions(self, name, amount, grid):
+        """调用 LLM 生成动作序列，校验失败时重问一次，仍失败则抛出 OutputValidationError"""
+        user_input = json.dumps({
+            "target": name,
+            "grid": grid,
+            "amount_ml": amount
+        })
+
+        messages = [
+            {"role": "system", "content": END2END_PROMPT},
+            {"role": "user", "content": user_input}
+        ]
+
+        content = self._chat(messages)
+        actions, errors = self._check(content)
+
+        # 校验失败时只重问一次，且只针对错误部分
+        if errors:
+            print(f"⚠️ 动作校验未通过，重新询问: {errors}")
+            messages += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": build_reask_prompt(errors)}
+            ]
+            actions, errors = self._check(self._chat(messages))
+
+        if errors:
+            raise OutputValidationError(errors)
+        return actions
+
+    def plan_tasks(self, recipe, location_map, bottle_offsets=None, update_layout=True):
+        """按原料拆分动作计划，返回 [{"ingredient", "grid", "amount_ml", "actions"}]
+
+        bottle_offsets: 可选，原料 -> 相机实测的瓶子位置偏移 [dx, dy, dz]，
+        用于修正抓取点（缓存中保存的始终是标准坐标的计划）。
+        update_layout: location_map 是否为货架当前的实际布局；预热等只想填充缓存的
+        调用传 False，不会淘汰按实际布局生成的计划。
+        """
+        # 布局变化时自动淘汰依赖旧坐标的缓存
+        if update_layout:
+            self.cache.update_layout(location_map)
+        deps = {step['ingredient']: location_map.get(step['ingredient']) for step in recipe}
+        key = self.cache.make_key(
+            [[step['ingredient'], step['amount_ml']] for step in recipe], deps, self.config_key
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"⚡ 命中动作计划缓存 ({len(cached)} 个原料)")
+            return self._refine(cached, bottle_offsets)
+
+        tasks = []
+        complete = True
 
         for step in recipe:
             name = step['ingredient']
@@ -106,14 +186,37 @@ class End2EndPlanner:
 
             if not grid:
                 print(f"⚠️ 找不到 {name}，跳过")
+                complete = False
                 continue
 
             actions = self.plan_ingredient(name, amount, grid)
             if actions:
-                full_plan.extend(actions)
+                tasks.append({"ingredient": name, "grid": grid, "amount_ml": amount, "actions": actions})
             else:
                 print(f"⚠️ {name} 动作生成失败")
-
+                complete = False
+
+        # 只缓存完整成功的计划
+        if complete and tasks:
+            self.cache.put(key, tasks, layout_deps=deps)
+        return self._refine(tasks, bottle_offsets)
+
+    @staticmethod
+    def _refine(tasks, bottle_offsets):
+        """按实测瓶子位置修正各原料的抓取点"""
+        for task in tasks:
+            offset = (bottle_offsets or {}).get(task["ingredient"])
+            refined = refine_grasp_actions(task["actions"], task["grid"], offset)
+            if refined is not task["actions"]:  # 偏差在死区内时原样返回
+                print(f"📐 {task['ingredient']} 抓取点修正: {offset}")
+                task["actions"] = refined
+        return tasks
+
+    def plan_recipe(self, recipe, location_map, bottle_offsets=None):
+        """根据配方和位置地图生成完整动作计划"""
+        full_plan = []
+        for task in self.plan_tasks(recipe, location_map, bottle_offsets):
+            full_plan.extend(task["actions"])
         return full_plan
 
 if __name__ == "__main__":
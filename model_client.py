@@ -0,0 +1,50 @@
+import os
+import threading
+
+_lock = threading.Lock()
+_env_loaded = False
+_client = None
+
+
+def get_api_key():
+    """读取 ZHIPUAI_API_KEY（首次调用时才加载 .env）"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+    return os.getenv("ZHIPUAI_API_KEY")
+
+
+def get_client():
+    """返回进程内共享的模型客户端，首次使用时才导入 SDK 并创建"""
+    global _client
+    with _lock:
+        if _client is None:
+            from zai import ZhipuAiClient
+            _client = ZhipuAiClient(api_key=get_api_key())
+        return _client
+
+
+class ModelBackend:
+    """模型调用基类：client 延迟到第一次请求时才创建，也可以直接赋值替换"""
+
+    _client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    def warm_up(self, model):
+        """预先建立到模型 API 的连接（发送一个极小的请求）"""
+        self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "ping"}],
+            max_tokens=1,
+        )
@@ -0,0 +1,275 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class ServiceBusy(Exception):
+    """订单队列已满"""
+
+
+class Order:
+    """一个订单及其进度事件"""
+
+    def __init__(self, order_id, text, priority):
+        self.id = order_id
+        self.text = text
+        self.priority = priority
+        self.status = "queued"
+        self.created = time.time()
+        self.events = []
+        self.changed = asyncio.Event()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "order": self.text,
+            "priority": self.priority,
+            "status": self.status,
+            "created": self.created,
+            "events": len(self.events),
+        }
+
+
+class OrderService:
+    """本地订单服务：随时接单进入有界优先队列，按顺序交给 agent 制作
+
+    HTTP 接口（JSON）：
+    - POST /orders           {"order": "来一杯拿铁", "priority": 0}，priority 越大越优先；队列满时返回 429
+    - GET  /orders           所有订单状态
+    - GET  /orders/<id>      单个订单状态
+    - GET  /orders/<id>/events  以 NDJSON 流式推送进度事件，订单结束后关闭
+    - GET  /status           队列长度和当前订单
+    """
+
+    def __init__(self, agent, host="127.0.0.1", port=8765, max_pending=16):
+        self.agent = agent
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.orders = {}
+        self.current = None
+
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._loop = None
+        self._queue = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=1)  # 只有一套机械臂流水线
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """在后台线程中启动事件循环和 HTTP 服务"""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()))
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait()
+        print(f"🌐 订单服务已启动: http://{self.host}:{self.port}")
+
+    def stop(self, drain=True):
+        """停止服务；drain=True 时先做完队列中的订单"""
+        if self._loop is None:
+            return
+        if drain:
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_pending)
+        self._stop_event = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        dispatcher = asyncio.create_task(self._dispatch())
+        self._ready.set()
+
+        await self._stop_event.wait()
+        dispatcher.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _drain(self):
+        await self._queue.join()
+
+    # ---------- 接单与派发 ----------
+
+    def submit(self, text, priority=0):
+        """线程安全的接单入口（供 REPL 等同进程客户端使用），返回订单"""
+        future = asyncio.run_coroutine_threadsafe(self._submit(text, priority), self._loop)
+        return future.result()
+
+    async def _submit(self, text, priority):
+        if self._queue.full():
+            raise ServiceBusy(f"队列已满（{self.max_pending} 单），请稍后再试")
+        order = Order(next(self._ids), text, priority)
+        self.orders[order.id] = order
+        self._queue.put_nowait((-priority, next(self._seq), order.id))
+        self._publish(order, "queued", f"前面还有 {self._queue.qsize() - 1} 单")
+        return order
+
+    async def _dispatch(self):
+        """按优先级逐个把订单交给 agent（在工作线程中执行）"""
+        while True:
+            _, _, order_id = await self._queue.get()
+            order = self.orders[order_id]
+            self.current = order
+            order.status = "running"
+            self._publish(order, "running", order.text)
+            try:
+                ok = await self._loop.run_in_executor(self._executor, self._run_order, order)
+                order.status = "done" if ok else "failed"
+                # 以返回值为准：最后一个事件与最终状态不一致时补发
+                if not order.events or order.events[-1]["stage"] != order.status:
+                    self._publish(order, order.status, "")
+            except Exception as e:
+                order.status = "failed"
+                self._publish(order, "failed", str(e))
+            finally:
+                self.current = None
+                self._queue.task_done()
+                order.changed.set()
+
+    def _run_order(self, order):
+        """工作线程：执行订单，把进度事件送回事件循环"""
+        def progress(stage, message):
+            self._loop.call_soon_threadsafe(self._publish, order, stage, message)
+        return self.agent.handle_order(order.text, progress=progress)
+
+    def _publish(self, order, stage, message):
+        """记录事件并唤醒正在等待的流式客户端"""
+        order.events.append({"stage": stage, "message": message, "time": time.time()})
+        changed, order.changed = order.changed, asyncio.Event()
+        changed.set()
+
+    # ---------- HTTP ----------
+
+    async def _handle_client(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("utf-8", "replace").split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1]
+
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("utf-8", "replace").strip()
+                if not line:
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                return await self._send_json(writer, 400, {"error": "Content-Length 不合法"})
+
+            body = await reader.readexactly(length) if length > 0 else b""
+            await self._route(method, path.rstrip("/"), body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, writer):
+        parts = path.strip("/").split("/")
+
+        if method == "POST" and parts == ["orders"]:
+            try:
+                data = json.loads(body or b"{}")
+                text = str(data["order"]).strip()
+                priority = int(data.get("priority", 0))
+            except (ValueError, KeyError, TypeError):
+                return await self._send_json(writer, 400, {"error": "需要 JSON: {\"order\": \"...\"}"})
+            if not text:
+                return await self._send_json(writer, 400, {"error": "订单内容为空"})
+            try:
+                order = await self._submit(text, priority)
+            except ServiceBusy as e:
+                return await self._send_json(writer, 429, {"error": str(e)}, {"Retry-After": "10"})
+            return await self._send_json(writer, 202, order.to_dict())
+
+        if method == "GET" and parts == ["status"]:
+            return await self._send_json(writer, 200, {
+                "pending": self._queue.qsize(),
+                "max_pending": self.max_pending,
+                "current": self.current.to_dict() if self.current else None,
+            })
+
+        if method == "GET" and parts == ["orders"]:
+            return await self._send_json(writer, 200, [o.to_dict() for o in self.orders.values()])
+
+        if method == "GET" and len(parts) in (2, 3) and parts[0] == "orders":
+            order = self.orders.get(int(parts[1])) if parts[1].isdigit() else None
+            if order is None:
+                return await self._send_json(writer, 404, {"error": "订单不存在"})
+            if len(parts) == 2:
+                return await self._send_json(writer, 200, dict(order.to_dict(), history=order.events))
+            if parts[2] == "events":
+                return await self._stream_events(order, writer)
+
+        await self._send_json(writer, 404, {"error": "未知接口"})
+
+    async def _send_json(self, writer, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(body))}
+        headers.update(extra_headers or {})
+        writer.write(self._status_line(status, headers) + body)
+        await writer.drain()
+
+    async def _stream_events(self, order, writer):
+        """以 NDJSON 逐行推送事件，直到订单结束"""
+        headers = {"Content-Type": "application/x-ndjson; charset=utf-8", "Cache-Control": "no-cache"}
+        writer.write(self._status_line(200, headers))
+        sent = 0
+        while True:
+            while sent < len(order.events):
+                writer.write(json.dumps(order.events[sent], ensure_ascii=False).encode("utf-8") + b"\n")
+                sent += 1
+            await writer.drain()
+            if order.status in TERMINAL_STATES and sent == len(order.events):
+                break
+            await order.changed.wait()
+
+    @staticmethod
+    def _status_line(status, headers):
+        reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+        lines = [f"HTTP/1.1 {status} {reasons.get(status, '')}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        lines.append("Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+if __name__ == "__main__":
+    # 命令行客户端: python order_service.py "来一杯拿铁" [优先级]
+    import sys
+    import urllib.request
+    import urllib.error
+
+    if len(sys.argv) < 2:
+        print('用法: python order_service.py "订单内容" [优先级]')
+        sys.exit(1)
+
+    base_url = "http://127.0.0.1:8765"
+    payload = json.dumps({"order": sys.argv[1], "priority": int(sys.argv[2]) if len(sys.argv) > 2 else 0})
+    request = urllib.request.Request(f"{base_url}/orders", data=payload.encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            order = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        print(f"❌ {json.loads(e.read()).get('error')}")
+        sys.exit(1)
+
+    print(f"📝 订单 #{order['id']} 已排队")
+    with urllib.request.urlopen(f"{base_url}/orders/{order['id']}/events") as stream:
+        for line in stream:
+            event = json.loads(line)
+            print(f"   [{event['stage']}] {event['message']}")
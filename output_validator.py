@@ -0,0 +1,352 @@
+import json
+import re
+
+# 货架上的 9 种标准原料名（与 coffee_env.py 中瓶子标签一致）
+INGREDIENTS = ["ESPRESSO", "WATER", "MILK", "VANILLA", "CARAMEL", "CHOCO", "OAT", "SUGAR", "ICE"]
+
+# 场景初始摆放：按上面的顺序从前排左侧开始，每排 3 个（与 coffee_env.py 一致）
+DEFAULT_LAYOUT = {name: [i // 3, i % 3] for i, name in enumerate(INGREDIENTS)}
+
+# 模型常见的别名写法 -> 标准名
+INGREDIENT_ALIASES = {
+    "OAT-MILK": "OAT",
+    "OAT_MILK": "OAT",
+    "OATMILK": "OAT",
+    "OAT MILK": "OAT",
+    "CHOCOLATE": "CHOCO",
+    "COCOA": "CHOCO",
+    "HOT-WATER": "WATER",
+    "HOT_WATER": "WATER",
+    "COFFEE": "ESPRESSO",
+    "WHOLE-MILK": "MILK",
+    "WHOLE_MILK": "MILK",
+    "ICE-CUBE": "ICE",
+    "ICE_CUBE": "ICE",
+}
+
+ACTION_FIELDS = {
+    "MOVE": "pos",
+    "GRAB": "width",
+    "WRIST": "angle",
+    "WAIT": "time",
+}
+
+# END2END_PROMPT 中的全局固定坐标
+WORK_POSE = [0, -0.2, 1.0]
+CUP_POSE = [-0.3, -0.2, 1.0]
+
+# END2END_PROMPT 规定的单个原料动作序列（SOP 14 步，第 8 步展开为 WRIST/WAIT/WRIST）
+SOP_COMMANDS = ["MOVE", "MOVE", "MOVE", "GRAB", "MOVE", "MOVE", "MOVE",
+                "WRIST", "WAIT", "WRIST",
+                "MOVE", "MOVE", "MOVE", "GRAB", "MOVE", "MOVE"]
+GRIPPER_OPEN = 0.04
+
+# 不计入总容量的原料（按份计量）
+VOLUME_EXEMPT = {"ICE"}
+
+MAX_VOLUME_ML = 1000
+GRID_SIZE = 3
+
+
+class OutputValidationError(ValueError):
+    """模型输出无法解析或修复时抛出，errors 中记录具体问题"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def normalize_ingredient(name):
+    """将原料名映射为标准名，无法识别时返回 None"""
+    if not isinstance(name, str):
+        return None
+    key = name.strip().upper()
+    if key in INGREDIENTS:
+        return key
+    return INGREDIENT_ALIASES.get(key)
+
+
+def _truncate_to_safe_point(text):
+    """截断到最后一个完整元素处，并补齐未闭合的括号"""
+    stack, in_str, escape = [], False, False
+    safe_end, safe_stack = 0, []
+
+    for i, ch in enumerate(text):
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+            continue
+
+        if ch == '"':
+            in_str = True
+        elif ch in "[{":
+            stack.append(ch)
+            safe_end, safe_stack = i + 1, list(stack)
+        elif ch in "]}":
+            if stack:
+                stack.pop()
+            safe_end, safe_stack = i + 1, list(stack)
+        elif ch == ",":
+            safe_end, safe_stack = i, list(stack)
+
+    if not stack and not in_str:
+        return text
+
+    closers = "".join("]" if c == "[" else "}" for c in reversed(safe_stack))
+    return text[:safe_end].rstrip().rstrip(",") + closers
+
+
+def _strip_trailing_commas(text):
+    """删除 ] 或 } 前的多余逗号，字符串内的内容保持不变"""
+    out, in_str, escape = [], False, False
+    for i, ch in enumerate(text):
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "," and text[i + 1:].lstrip()[:1] in ("]", "}"):
+            continue
+        out.append(ch)
+    return "".join(out)
+
+
+def repair_json_text(text, container="{"):
+    """本地修复：去除代码块、截取 JSON 主体、删除尾逗号，返回 (JSON 文本, 是否被截断)
+
+    输出被截断时补齐到最后一个完整元素，并把 truncated 置为 True。
+    """
+    if not isinstance(text, str):
+        raise OutputValidationError(["输出不是文本"])
+
+    text = re.sub(r"```(?:json)?", "", text)
+    start = text.find(container)
+    if start == -1:
+        raise OutputValidationError([f"输出中找不到 '{container}'"])
+
+    # 合法 JSON 原样返回，避免修复逻辑改动字符串内容
+    decoder = json.JSONDecoder()
+    try:
+        _, end = decoder.raw_decode(text, start)
+        return text[start:end], False
+    except json.JSONDecodeError:
+        pass
+
+    body = _strip_trailing_commas(text[start:])
+    try:
+        _, end = decoder.raw_decode(body)
+        return body[:end], False
+    except json.JSONDecodeError:
+        # 可能是尾部被截断：截到最后一个完整元素并补齐括号
+        return _truncate_to_safe_point(body), True
+
+
+def parse_json(text, container="{"):
+    """修复并解析模型输出，失败或输出被截断时抛出 OutputValidationError
+
+    截断补齐后的内容缺少了后半部分，不能当作完整结果使用，交给调用方重问。
+    """
+    body, truncated = repair_json_text(text, container)
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise OutputValidationError([f"JSON 解析失败: {e}"])
+    if truncated:
+        raise OutputValidationError(["输出被截断，JSON 不完整，请输出完整内容"])
+    return data
+
+
+def _to_number(value):
+    """将 40 / "40" / "40ml" 等形式转为数值，失败返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*(?:ml|ML|s)?\s*", value)
+        if match:
+            num = float(match.group(1))
+            return int(num) if num.is_integer() else num
+    return None
+
+
+def validate_recipe(data):
+    """校验配方，返回 (修正后的配方, 错误列表)"""
+    if not isinstance(data, dict):
+        return None, ["配方必须是 JSON 对象"]
+
+    status = data.get("status")
+    if status == "reject":
+        message = data.get("message") or data.get("reason") or "抱歉，我做不了这个。"
+        return {"status": "reject", "reason": data.get("reason", message), "message": message}, []
+    if status != "success":
+        return None, [f"status 必须是 'success' 或 'reject'，实际为 {status!r}"]
+
+    errors = []
+    steps = []
+    raw_steps = data.get("steps")
+    if not isinstance(raw_steps, list) or not raw_steps:
+        errors.append("steps 必须是非空列表")
+        raw_steps = []
+
+    for i, step in enumerate(raw_steps):
+        if not isinstance(step, dict):
+            errors.append(f"steps[{i}] 必须是对象")
+            continue
+        name = normalize_ingredient(step.get("ingredient"))
+        if name is None:
+            errors.append(f"steps[{i}].ingredient 未知: {step.get('ingredient')!r}")
+            continue
+        amount = _to_number(step.get("amount_ml"))
+        if amount is None or amount <= 0:
+            errors.append(f"steps[{i}].amount_ml 必须是正数: {step.get('amount_ml')!r}")
+            continue
+        steps.append({"ingredient": name, "amount_ml": amount})
+
+    # ICE 按"份"计量，不计入液体容量
+    liquid = sum(s["amount_ml"] for s in steps if s["ingredient"] not in VOLUME_EXEMPT)
+    total = _to_number(data.get("total_volume_ml"))
+    if total is None:
+        total = liquid
+    elif steps and not errors and abs(liquid - total) > 1e-6:
+        errors.append(f"各原料用量之和 {liquid}ml 与 total_volume_ml {total}ml 不一致（ICE 不计入）")
+    if total > MAX_VOLUME_ML:
+        errors.append(f"total_volume_ml 超过上限 {MAX_VOLUME_ML}ml")
+
+    recipe = {
+        "status": "success",
+        "product_name": data.get("product_name") or "咖啡",
+        "total_volume_ml": total,
+        "steps": steps,
+        "message": data.get("message", ""),
+    }
+    return recipe, errors
+
+
+def validate_location_map(data):
+    """校验位置地图，返回 (合法条目, 错误列表)；错误条目不会出现在结果中"""
+    if not isinstance(data, dict):
+        return {}, ["位置地图必须是 JSON 对象"]
+
+    location_map, errors, occupied = {}, [], {}
+    for raw_name, grid in data.items():
+        name = normalize_ingredient(raw_name)
+        if name is None:
+            continue  # 未知物体直接忽略
+
+        if isinstance(grid, str):
+            grid = re.findall(r"-?\d+", grid)
+        if not isinstance(grid, (list, tuple)) or len(grid) != 2:
+            errors.append(f"{name}: 坐标必须是 [row, col]，实际为 {grid!r}")
+            continue
+
+        # 0.0 / 1.0 这类整数值的小数直接转成 int
+        cell = [_to_number(v) for v in grid]
+        cell = [int(v) if isinstance(v, float) and v.is_integer() else v for v in cell]
+        if any(not isinstance(v, int) or not 0 <= v < GRID_SIZE for v in cell):
+            errors.append(f"{name}: 坐标超出 0-{GRID_SIZE - 1} 范围: {grid!r}")
+            continue
+
+        key = tuple(cell)
+        if key in occupied:
+            errors.append(f"{name} 与 {occupied[key]} 坐标重复: {cell}")
+            location_map.pop(occupied[key], None)
+            continue
+        occupied[key] = name
+        location_map[name] = cell
+
+    return location_map, errors
+
+
+def validate_actions(data):
+    """校验动作序列，返回 (修正后的动作列表, 错误列表)"""
+    if not isinstance(data, list):
+        return [], ["动作序列必须是 JSON 列表"]
+
+    actions, errors = [], []
+    for i, act in enumerate(data):
+        if not isinstance(act, dict):
+            errors.append(f"[{i}] 必须是对象")
+            continue
+        cmd = str(act.get("cmd", "")).upper()
+        field = ACTION_FIELDS.get(cmd)
+        if field is None:
+            errors.append(f"[{i}] 未知指令: {act.get('cmd')!r}")
+            continue
+
+        value = act.get(field)
+        if cmd == "MOVE":
+            pos = [_to_number(v) for v in value] if isinstance(value, (list, tuple)) else []
+            if len(pos) != 3 or None in pos:
+                errors.append(f"[{i}] MOVE.pos 必须是 3 个数值: {value!r}")
+                continue
+            actions.append({"cmd": cmd, "pos": pos})
+            continue
+
+        num = _to_number(value)
+        if cmd == "WAIT" and value is None:
+            num = 1.0
+        if num is None:
+            errors.append(f"[{i}] {cmd}.{field} 必须是数值: {value!r}")
+        elif cmd == "GRAB" and not 0 <= num <= 0.04:
+            errors.append(f"[{i}] GRAB.width 超出 0-0.04 范围: {num}")
+        elif cmd == "WAIT" and num < 0:
+            errors.append(f"[{i}] WAIT.time 不能为负: {num}")
+        else:
+            actions.append({"cmd": cmd, field: num})
+
+    # 逐条都合法后再检查整体结构，避免同一个问题重复报告
+    if not errors:
+        errors = check_action_sequence(actions)
+    return actions, errors
+
+
+def check_action_sequence(actions):
+    """按 END2END_PROMPT 的 SOP 检查动作序列的整体结构，返回错误列表
+
+    单条动作合法不代表整段可执行：抓取/松开必须成对，手腕倒完要转回，
+    最后必须回到 Work Pose，否则下一个原料会从错误的状态开始。
+    """
+    errors = []
+    cmds = [act["cmd"] for act in actions]
+    if cmds != SOP_COMMANDS:
+        errors.append(f"动作序列结构不符合 SOP：应为 {len(SOP_COMMANDS)} 个动作 {SOP_COMMANDS}，实际为 {cmds}")
+
+    widths = [act["width"] for act in actions if act["cmd"] == "GRAB"]
+    if widths != [0, GRIPPER_OPEN]:
+        errors.append(f"GRAB 必须先闭合 (0.0) 再张开 ({GRIPPER_OPEN})，实际为 {widths}")
+
+    angles = [act["angle"] for act in actions if act["cmd"] == "WRIST"]
+    if abs(sum(angles)) > 1e-6:
+        errors.append(f"WRIST 转角之和必须为 0（倒完要转回），实际为 {angles}")
+
+    moves = [act["pos"] for act in actions if act["cmd"] == "MOVE"]
+    if not moves or any(abs(a - b) > 1e-3 for a, b in zip(moves[-1], WORK_POSE)):
+        errors.append(f"最后一个 MOVE 必须回到 Work Pose {WORK_POSE}")
+    return errors
+
+
+def build_reask_prompt(errors, previous_output=None):
+    """生成只针对错误部分的重问提示"""
+    lines = ["你上一次的输出未通过校验，请只修正以下问题，并按原格式重新输出完整 JSON，不要任何解释："]
+    lines += [f"- {e}" for e in errors]
+    if previous_output:
+        lines.append(f"\n上一次的输出:\n{previous_output}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(parse_json('```json\n{"ESPRESSO": [0, 0], "OAT-MILK": [2, 0],}\n```'))
+    print(repair_json_text('[{"cmd": "MOVE", "pos": [0, -0.2, 1.0]}, {"cmd": "GRAB", "wid', "["))
+    print(validate_recipe({"status": "success", "product_name": "燕麦拿铁",
+                           "steps": [{"ingredient": "ESPRESSO", "amount_ml": "40ml"},
+                                     {"ingredient": "OAT-MILK", "amount_ml": 310}]}))
+    print(validate_location_map({"ESPRESSO": [0, 0], "MILK": [0, 0], "ICE": "2,2", "TEA": [1, 1]}))
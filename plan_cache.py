@@ -0,0 +1,66 @@
+import copy
+import json
+import threading
+from collections import OrderedDict
+
+
+class PlanCache:
+    """有界 LRU 缓存：可按货架布局自动失效
+
+    每个条目可以附带 layout_deps（原料 -> 坐标），当 update_layout 发现
+    这些原料的坐标发生变化时，条目会被自动移除。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """把任意 JSON 可序列化的内容组合成稳定的键"""
+        return json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """命中时返回副本并移到最近使用，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+
+    def put(self, key, value, layout_deps=None):
+        """写入条目，超出容量时淘汰最久未使用的"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), dict(layout_deps or {}))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update_layout(self, location_map):
+        """货架布局更新后，移除依赖坐标已变化的条目，返回移除数量"""
+        with self._lock:
+            stale = [
+                key for key, (_, deps) in self._entries.items()
+                if any(list(location_map.get(name) or []) != list(cell) for name, cell in deps.items())
+            ]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -1,9 +1,8 @@
-import os
 import json
-from zai import ZhipuAiClient
-from dotenv import load_dotenv
-
-load_dotenv()
+from model_client import ModelBackend, get_api_key
+from output_validator import OutputValidationError, parse_json, validate_recipe, build_reask_prompt
+from recipe_rules import parse_order
+from request_coalescer import RequestCoalescer
 
 # 咖啡师大脑的核心配置
 SYSTEM_PROMPT = """
@@ -67,37 +66,81 @@ SYSTEM_PROMPT = """
 }
 """
 
-class RecipeLLM:
+class RecipeLLM(ModelBackend):
     """配方生成器：基于 LLM 将订单转化为结构化配方"""
 
-    def __init__(self):
-        self.api_key = os.getenv("ZHIPUAI_API_KEY")
+    def __init__(self, wait_timeout=60):
+        self.api_key = get_api_key()
         if not self.api_key:
             raise ValueError("❌ 错误：未设置 ZHIPUAI_API_KEY")
-        self.client = ZhipuAiClient(api_key=self.api_key)
+        self.model = "glm-4.5-flash"
+
+        # 同时到达的相同订单只调用一次 LLM
+        self.coalescer = RequestCoalescer(timeout=wait_timeout)
+
+    def _chat(self, messages):
+        """调用 LLM 并返回原始文本"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=0.1,
+        )
+        return response.choices[0].message.content
+
+    def _check(self, content):
+        """本地修复并校验配方，返回 (配方, 错误列表)"""
+        try:
+            return validate_recipe(parse_json(content, "{"))
+        except OutputValidationError as e:
+            return None, e.errors
 
     def generate_recipe(self, user_order: str):
         """根据用户订单生成配方"""
         print(f"☕ 收到订单: {user_order}")
 
-        try:
-            response = self.client.chat.completions.create(
-                model="glm-4.5-flash",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_order}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1,
-            )
-
-            result = json.loads(response.choices[0].message.content)
-            return result
+        # 标准菜单订单直接按规则生成，无需调用 LLM
+        local_recipe = parse_order(user_order)
+        if local_recipe:
+            print("⚡ 命中本地配方规则")
+            return local_recipe
 
+        try:
+            order = user_order.strip()
+            return self.coalescer.run(self.coalescer.make_key(self.model, order), lambda: self._ask_recipe(order))
+        except OutputValidationError as e:
+            print(f"❌ 配方校验失败: {e.errors}")
+            return None
+        except TimeoutError:
+            print("❌ 思考失败: 等待配方超时")
+            return None
         except Exception as e:
             print(f"❌ 思考失败: {e}")
             return None
 
+    def _ask_recipe(self, user_order):
+        """调用 LLM 生成配方，校验失败时重问一次，仍失败则抛出 OutputValidationError"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_order}
+        ]
+
+        content = self._chat(messages)
+        result, errors = self._check(content)
+
+        # 校验失败时只重问一次，且只针对错误部分
+        if errors:
+            print(f"⚠️ 配方校验未通过，重新询问: {errors}")
+            messages += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": build_reask_prompt(errors)}
+            ]
+            result, errors = self._check(self._chat(messages))
+
+        if errors:
+            raise OutputValidationError(errors)
+        return result
+
 if __name__ == "__main__":
     brain = RecipeLLM()
 
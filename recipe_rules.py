@@ -0,0 +1,150 @@
+import re
+from output_validator import MAX_VOLUME_ML, validate_recipe
+
+# 与 recipe_llm.SYSTEM_PROMPT 中的规则保持一致
+DEFAULT_VOLUME_ML = 350
+ESPRESSO_ML = 40
+CHOCO_ML = 30
+SYRUP_ML = 20
+SWEET_EXTRA_ML = 10
+STRONG_EXTRA_ML = 20
+ICE_PORTION = 1
+
+# 饮品: (关键词, 名称, 固定原料, 主液)，长关键词在前
+DRINKS = [
+    (("燕麦奶拿铁", "燕麦拿铁", "oat milk latte", "oat latte"), "燕麦拿铁", [("ESPRESSO", ESPRESSO_ML)], "OAT"),
+    (("卡布奇诺", "cappuccino"), "卡布奇诺", [("ESPRESSO", ESPRESSO_ML)], "MILK"),
+    (("摩卡", "mocha"), "摩卡", [("ESPRESSO", ESPRESSO_ML), ("CHOCO", CHOCO_ML)], "MILK"),
+    (("拿铁", "latte"), "拿铁", [("ESPRESSO", ESPRESSO_ML)], "MILK"),
+    (("美式", "americano"), "美式", [("ESPRESSO", ESPRESSO_ML)], "WATER"),
+]
+
+FLAVORS = [
+    (("焦糖", "caramel"), "焦糖", "CARAMEL"),
+    (("香草", "vanilla"), "香草", "VANILLA"),
+]
+
+ICED_WORDS = ("加冰", "冰的", "冰", "iced")
+HOT_WORDS = ("热的", "热", "hot")
+SWEET_WORDS = ("甜一点", "甜一些", "多加糖", "加糖", "sweeter")
+STRONG_WORDS = ("浓一点", "浓一些", "stronger")
+
+# 可以忽略的客套话/量词
+FILLER_WORDS = (
+    "麻烦", "请给我", "给我", "我要", "我想要", "帮我", "来一杯", "做一杯", "一杯", "来杯", "要杯", "来",
+    "咖啡", "谢谢", "的", "杯", "please", "can i have", "i want", "i'd like", "give me",
+    "a cup of", "one", "an", "a", "coffee", "thanks",
+)
+
+VOLUME_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(ml|毫升|l|升)(?![a-z])")
+
+
+def _take(text, words):
+    """在文本中查找并移除第一个命中的关键词，返回 (是否命中, 剩余文本)"""
+    for word in words:
+        if word in text:
+            return True, text.replace(word, " ", 1)
+    return False, text
+
+
+def _parse_volume(text):
+    """解析容量，返回 (ml 或 None, 剩余文本)"""
+    match = VOLUME_PATTERN.search(text)
+    if not match:
+        return None, text
+    value = float(match.group(1))
+    if match.group(2) in ("l", "升"):
+        value *= 1000
+    return int(round(value)), text[:match.start()] + " " + text[match.end():]
+
+
+def parse_order(user_order):
+    """用规则解析常见订单，无法确定时返回 None 交给 LLM"""
+    text = user_order.strip().lower()
+    if not text:
+        return None
+
+    volume, text = _parse_volume(text)
+
+    drink = None
+    for words, name, fixed, main in DRINKS:
+        hit, text = _take(text, words)
+        if hit:
+            drink = (name, fixed, main)
+            break
+    if drink is None:
+        return None
+
+    flavor = None
+    for words, label, ingredient in FLAVORS:
+        hit, text = _take(text, words)
+        if hit:
+            flavor = (label, ingredient)
+            break
+
+    sweet, text = _take(text, SWEET_WORDS)
+    strong, text = _take(text, STRONG_WORDS)
+    iced, text = _take(text, ICED_WORDS)
+    hot, text = _take(text, HOT_WORDS)
+    if iced and hot:
+        return None  # 冷热矛盾，交给 LLM 判断
+
+    # 剩余内容必须全是客套话，否则说明有规则无法理解的要求
+    residual = re.sub(r"[\s，。,.!！?？~、]+", " ", text)
+    for word in sorted(FILLER_WORDS, key=len, reverse=True):
+        if re.fullmatch(r"[a-z' ]+", word):
+            residual = re.sub(rf"\b{re.escape(word)}\b", " ", residual)
+        else:
+            residual = residual.replace(word, " ")
+    if residual.strip():
+        return None
+
+    total = volume if volume is not None else DEFAULT_VOLUME_ML
+    if total > MAX_VOLUME_ML:
+        return {
+            "status": "reject",
+            "reason": f"容量 {total}ml 超过了 {MAX_VOLUME_ML}ml 的上限。",
+            "message": "抱歉，我做不了这么大杯。"
+        }
+
+    name, fixed, main = drink
+    amounts = dict(fixed)
+    if strong:
+        amounts["ESPRESSO"] += STRONG_EXTRA_ML
+    if flavor:
+        amounts[flavor[1]] = SYRUP_ML + (SWEET_EXTRA_ML if sweet else 0)
+    elif sweet:
+        amounts["SUGAR"] = SWEET_EXTRA_ML
+
+    remaining = total - sum(amounts.values())
+    if remaining <= 0:
+        return None  # 容量太小，交给 LLM 判断
+
+    # 原料顺序: 固体 -> 浓缩 -> 糖浆/酱 -> 主液
+    steps = []
+    if iced:
+        steps.append({"ingredient": "ICE", "amount_ml": ICE_PORTION})
+    if "SUGAR" in amounts:
+        steps.append({"ingredient": "SUGAR", "amount_ml": amounts.pop("SUGAR")})
+    steps.append({"ingredient": "ESPRESSO", "amount_ml": amounts.pop("ESPRESSO")})
+    steps += [{"ingredient": k, "amount_ml": v} for k, v in amounts.items()]
+    steps.append({"ingredient": main, "amount_ml": remaining})
+
+    product_name = ("冰" if iced else "热" if hot else "") + (flavor[0] if flavor else "") + name
+    notes = [w for w, on in (("加甜", sweet), ("加浓", strong)) if on]
+    message = f"为您制作的{product_name}，共 {total}ml" + (f"，已{'、'.join(notes)}。" if notes else "。")
+
+    recipe, errors = validate_recipe({
+        "status": "success",
+        "product_name": product_name,
+        "total_volume_ml": total,
+        "steps": steps,
+        "message": message
+    })
+    return None if errors else recipe
+
+
+if __name__ == "__main__":
+    for order in ["来一杯热拿铁", "我要一杯600ml的燕麦拿铁，甜一点", "冰美式 浓一点", "给我来一桶2升的咖啡",
+                  "iced caramel latte 500ml please", "我要一杯抹茶星冰乐", "两杯拿铁"]:
+        print(order, "->", parse_order(order))
@@ -0,0 +1,64 @@
+import copy
+import threading
+from concurrent import futures
+
+from plan_cache import PlanCache
+
+
+class RequestCoalescer:
+    """合并同时进行的相同请求：同一个键只发起一次底层调用，所有等待者共享结果
+
+    与 PlanCache 不同，这里只合并"正在进行中"的请求，调用结束后条目立即移除。
+    底层调用在独立线程中执行，某个等待者超时不会影响其他等待者；
+    调用抛出的异常会传给所有等待者。
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout  # 每个等待者的默认超时（秒），None 表示一直等待
+        self.calls = 0
+        self.joined = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    # 与 PlanCache 使用同一种键格式
+    make_key = staticmethod(PlanCache.make_key)
+
+    def run(self, key, fn, timeout=None):
+        """执行 fn() 或加入已在进行的相同请求，返回结果副本
+
+        超时抛出 TimeoutError（底层调用继续进行，其他等待者不受影响）。
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = futures.Future()
+                self._inflight[key] = future
+                self.calls += 1
+                threading.Thread(target=self._call, args=(key, fn, future), daemon=True).start()
+            else:
+                self.joined += 1
+
+        try:
+            result = future.result(timeout=self.timeout if timeout is None else timeout)
+        except futures.TimeoutError:
+            raise TimeoutError(f"等待请求结果超时: {key[:80]}") from None
+        return copy.deepcopy(result)  # 每个等待者拿到独立副本，互不影响
+
+    def _call(self, key, fn, future):
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def stats(self):
+        return {"in_flight": self.in_flight(), "calls": self.calls, "joined": self.joined}
@@ -1,37 +1,163 @@
 import pybullet as p
 import time
 import math
+from plan_cache import PlanCache
+
+def is_approach_segment(a, b, tol=1e-3):
+    """判断两点之间是否为沿 Y 轴的水平进退段（X、Z 不变）"""
+    return abs(a[0] - b[0]) < tol and abs(a[2] - b[2]) < tol and abs(a[1] - b[1]) >= tol
+
+
+def _ramp_fraction(t, n, a, b):
+    """梯形速度曲线：时长 n，加速 a 步、减速 b 步（速度线性变化），返回 t 时刻完成的比例"""
+    if t <= 0:
+        return 0.0
+    if t >= n:
+        return 1.0
+    d = n - a / 2 - b / 2
+    if t < a:
+        return t * t / (2 * a) / d
+    if t <= n - b:
+        return (t - a / 2) / d
+    return 1.0 - (n - t) ** 2 / (2 * b) / d
+
+
+def blend_joint_path(joint_points, segment_steps, blend_steps):
+    """关节空间多段轨迹，途经点处抛物线融合，返回每个控制周期的关节指令
+
+    joint_points: 起点及各目标点的关节角；segment_steps: 每段的步数；
+    blend_steps: 每个点的融合半宽（步数），起点和终点应为 0，且每段两端之和不超过该段步数的一半。
+
+    每段是独立的梯形速度曲线，在途经点 i 处以 2 * blend_steps[i] 的时长减速，
+    下一段同时以相同时长加速；两段叠加后速度线性过渡（即抛物线融合）。
+    相邻两段在融合窗口内重叠执行，总步数比逐段执行少 2 * sum(blend_steps)。
+    """
+    starts = [0.0]
+    for j in range(1, len(segment_steps)):
+        starts.append(starts[-1] + segment_steps[j - 1] - 2 * blend_steps[j])
+    total = math.ceil(starts[-1] + segment_steps[-1] - 1e-9)
+
+    deltas = [[b - a for a, b in zip(joint_points[j], joint_points[j + 1])] for j in range(len(segment_steps))]
+    commands = []
+    for k in range(1, total + 1):
+        command = list(joint_points[0])
+        for j, n in enumerate(segment_steps):
+            f = _ramp_fraction(k - starts[j], n, 2 * blend_steps[j], 2 * blend_steps[j + 1])
+            if f:
+                command = [q + f * d for q, d in zip(command, deltas[j])]
+        commands.append(command)
+    return commands
+
+
+def group_moves(actions, blend=True):
+    """遍历动作序列，开启融合时把连续多个 MOVE 合并为一条 MOVE_THROUGH
+
+    逐个产出 (start, end, act)：actions[start:end] 对应 act；
+    合并后的 act 为 {"cmd": "MOVE_THROUGH", "targets": [...]}，其余为原动作。
+    """
+    i = 0
+    while i < len(actions):
+        j = i + 1
+        if blend and actions[i].get("cmd") == "MOVE":
+            while j < len(actions) and actions[j].get("cmd") == "MOVE":
+                j += 1
+        if j - i > 1:
+            yield i, j, {"cmd": "MOVE_THROUGH", "targets": [a["pos"] for a in actions[i:j]]}
+        else:
+            yield i, j, actions[i]
+        i = j
+
 
 class RobotController:
     """机械臂控制器：执行 IK 计算和关节运动控制"""
 
-    def __init__(self):
-        # 连接到仿真服务器
-        try:
-            self.client_id = p.connect(p.SHARED_MEMORY)
-            if self.client_id < 0:
-                raise Exception
-        except:
-            print("❌ 请先运行 coffee_env.py")
-            exit()
+    def __init__(self, robot_index=0, ik_cache_size=256, connect_timeout=10.0, ik_tolerance=0.002):
+        # 连接到仿真服务器（服务器可能还在启动，重试直到超时）
+        self.client_id = self._connect(connect_timeout)
+        if self.client_id < 0:
+            raise ConnectionError("❌ 无法连接仿真服务器，请先运行 coffee_env.py")
 
         print("✅ 连接成功")
-        self.robotId = self._find_robot_id()
+        self.robot_index = robot_index
+        self.robotId = self._find_robot_id(robot_index)
+        deadline = time.monotonic() + connect_timeout
+        while self.robotId is None and time.monotonic() < deadline:
+            time.sleep(0.2)  # 场景可能尚未加载完成
+            self.robotId = self._find_robot_id(robot_index)
+        if self.robotId is None:
+            raise ConnectionError(
+                f"❌ 场景中找不到第 {robot_index + 1} 个机械臂，请用相同的机械臂数量运行 coffee_env.py"
+            )
         self.end_effector_index = 11
+        self.base_pos = list(p.getBasePositionAndOrientation(self.robotId)[0])
+        self.recorder = None  # 可选的 TelemetryRecorder
+        self.ik_cache = PlanCache(max_entries=ik_cache_size)  # 目标点 -> 关节角及末端误差
+        self.ik_tolerance = ik_tolerance  # 末端位置误差上限（米）
+        self._twin = None  # IK 用的孪生机械臂 (client, body)，首次求解时创建
+        self._last_command = None
 
-    def _find_robot_id(self):
-        """查找 Franka Panda 机械臂的 ID"""
+    def _connect(self, timeout):
+        """以共享内存方式连接服务器，已连接时直接复用"""
+        if p.isConnected():
+            return 0
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                client_id = p.connect(p.SHARED_MEMORY)
+            except Exception:
+                client_id = -1
+            if client_id >= 0 or time.monotonic() >= deadline:
+                return client_id
+            time.sleep(0.2)
+
+    def _find_robot_id(self, robot_index=0):
+        """查找第 robot_index 个 Franka Panda 机械臂的 ID"""
         num = p.getNumBodies()
+        found = 0
         for i in range(num):
-            if "panda" in p.getBodyInfo(i)[1].decode("utf-8"):
-                return i
+            body_id = p.getBodyUniqueId(i)
+            if "panda" in p.getBodyInfo(body_id)[1].decode("utf-8"):
+                if found == robot_index:
+                    return body_id
+                found += 1
         return None
     
-    def move_to_smooth(self, target_pos, steps=100, delay=0.01):
-        """平滑移动到目标位置（带零空间约束和高精度IK）"""
-        if self.robotId is None:
-            return
+    def _solve_ik(self, target_pos):
+        """高精度 IK：抓手垂直向下，返回 7 个关节角度（同一机械臂同一目标点复用缓存）
+
+        缓存中同时保存解的末端误差：误差超过 ik_tolerance 的条目命中时会以缓存解为起点重新求解，
+        避免从别的起始姿态（如预热时的初始姿态）算出的低精度解被一直复用。
+        """
+        key = None
+        seed = None
+        if self.ik_cache is not None:
+            key = self.ik_cache.make_key(self.base_pos, self.end_effector_index, [round(v, 4) for v in target_pos])
+            cached = self.ik_cache.get(key)
+            if cached is not None:
+                if cached["residual"] <= self.ik_tolerance:
+                    return cached["joints"]
+                seed = cached["joints"]
+
+        joints, residual = self._calculate_ik(target_pos, seed)
+        if key is not None:
+            self.ik_cache.put(key, {"joints": joints, "residual": residual})
+        return joints
 
+    def _ik_twin(self):
+        """独立的 DIRECT 物理客户端中的同款机械臂，用于迭代求解和正运动学校验，不影响仿真"""
+        if self._twin is None:
+            import pybullet_data
+            client = p.connect(p.DIRECT)
+            p.setAdditionalSearchPath(pybullet_data.getDataPath(), physicsClientId=client)
+            body = p.loadURDF("franka_panda/panda.urdf", useFixedBase=True, physicsClientId=client)
+            # 两边都按质心坐标读写底座位姿，保证与仿真中的机械臂完全重合
+            pos, orn = p.getBasePositionAndOrientation(self.robotId)
+            p.resetBasePositionAndOrientation(body, pos, orn, physicsClientId=client)
+            self._twin = (client, body)
+        return self._twin
+
+    def _calculate_ik(self, target_pos, seed=None, max_rounds=5):
+        """从 seed（默认当前关节角）开始反复求解 IK，直到末端误差低于 ik_tolerance，返回 (关节角, 误差)"""
         # Franka 机械臂物理限制
         ll = [-2.96, -1.83, -2.96, -3.09, -2.96, -0.08, -2.96]
         ul = [ 2.96,  1.83,  2.96,  0.08,  2.96,  3.82,  2.96]
@@ -41,19 +167,71 @@ class RobotController:
         # 姿态：抓手垂直向下
         orn = p.getQuaternionFromEuler([math.pi, math.pi/2, -math.pi/2])
 
-        # 高精度 IK 计算
-        target_joints = p.calculateInverseKinematics(
-            self.robotId,
-            self.end_effector_index,
-            target_pos,
-            orn,
-            lowerLimits=ll,
-            upperLimits=ul,
-            jointRanges=jr,
-            restPoses=rp,
-            maxNumIterations=100,
-            residualThreshold=1e-5
-        )
+        client, body = self._ik_twin()
+        joints = list(seed) if seed is not None else self.get_current_joint_angles()
+        best, best_residual = joints, float("inf")
+
+        # PyBullet IK 从当前关节状态开始迭代：在孪生体上设好起点，求解后再以结果为起点继续
+        for _ in range(max_rounds):
+            for i in range(7):
+                p.resetJointState(body, i, joints[i], physicsClientId=client)
+            joints = list(p.calculateInverseKinematics(
+                body,
+                self.end_effector_index,
+                target_pos,
+                orn,
+                lowerLimits=ll,
+                upperLimits=ul,
+                jointRanges=jr,
+                restPoses=rp,
+                maxNumIterations=100,
+                residualThreshold=1e-5,
+                physicsClientId=client
+            )[:7])
+
+            for i in range(7):
+                p.resetJointState(body, i, joints[i], physicsClientId=client)
+            reached = p.getLinkState(body, self.end_effector_index, computeForwardKinematics=True,
+                                     physicsClientId=client)[4]
+            residual = math.dist(reached, target_pos)
+            if residual < best_residual:
+                best, best_residual = joints, residual
+            if residual <= self.ik_tolerance:
+                break
+        return best, best_residual
+
+    def warm_ik_cache(self, targets):
+        """预先计算一批目标点的 IK，填充缓存"""
+        if self.robotId is None or self.ik_cache is None:
+            return
+        for target in targets:
+            self._solve_ik(target)
+
+    def _command_joints(self, joints):
+        """下发 7 个关节的位置指令"""
+        self._last_command = joints
+        for i in range(7):
+            p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=joints[i], force=200)
+
+    def _run_ticks(self, ticks, delay):
+        """阻塞执行一个逐周期的动作生成器"""
+        for _ in ticks:
+            self.record_tick()
+            time.sleep(delay)
+
+    def record_tick(self):
+        """把当前周期的指令与实测状态写入记录器（未开启记录时直接返回）"""
+        if self.recorder is None or self.robotId is None:
+            return
+        states = p.getJointStates(self.robotId, [0, 1, 2, 3, 4, 5, 6, 9, 10])
+        measured = [s[0] for s in states[:7]]
+        gripper = states[7][0] + states[8][0]
+        link = p.getLinkState(self.robotId, self.end_effector_index)
+        self.recorder.record(self._last_command or measured, measured, gripper, link[4], link[5])
+
+    def move_ticks(self, target_pos, steps=100):
+        """逐周期生成移动指令：每 yield 一次代表一个控制周期"""
+        target_joints = self._solve_ik(target_pos)
 
         # 平滑插值
         start_joints = self.get_current_joint_angles()
@@ -64,34 +242,53 @@ class RobotController:
                 angle = start_joints[i] + (target_joints[i] - start_joints[i]) * t
                 current_command.append(angle)
 
-            for i in range(7):
-                p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=current_command[i], force=200)
-            time.sleep(delay)
+            self._command_joints(current_command)
+            yield
 
         # 锁定最终位置
-        for i in range(7):
-            p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=target_joints[i], force=200)
+        self._command_joints(target_joints)
 
-    def grab(self, width=0.0, steps=50, delay=0.01):
-        """平滑抓取/释放（控制夹爪开合）"""
-        if self.robotId is None:
-            return
+    def move_through_ticks(self, targets, steps=150, blend_radius=0.05):
+        """逐周期生成融合轨迹指令，见 move_through"""
+        points = [self.get_end_effector_pos()] + [list(t) for t in targets]
+        joint_points = [self.get_current_joint_angles()] + [self._solve_ik(t) for t in targets]
+        segment_steps = [steps] * len(targets)
+
+        blend_steps = [0] * len(points)
+        for i in range(1, len(points) - 1):
+            if is_approach_segment(points[i - 1], points[i]) or is_approach_segment(points[i], points[i + 1]):
+                continue
+            len_in = math.dist(points[i - 1], points[i])
+            len_out = math.dist(points[i], points[i + 1])
+            if len_in < 1e-6 or len_out < 1e-6:
+                continue
+            blend_steps[i] = min(blend_radius / len_in * steps, blend_radius / len_out * steps, steps / 4)
+
+        for command in blend_joint_path(joint_points, segment_steps, blend_steps):
+            self._command_joints(command)
+            yield
+
+        # 锁定最终位置
+        self._command_joints(joint_points[-1])
+
+    def grab_ticks(self, width=0.0, steps=50, settle_steps=20):
+        """逐周期生成夹爪开合指令"""
         start_width = p.getJointState(self.robotId, 9)[0]
         for step in range(steps):
             t = step / steps
             current_width = start_width + (width - start_width) * t
             p.setJointMotorControl2(self.robotId, 9, p.POSITION_CONTROL, targetPosition=current_width, force=20)
             p.setJointMotorControl2(self.robotId, 10, p.POSITION_CONTROL, targetPosition=current_width, force=20)
-            time.sleep(delay)
+            yield
         p.setJointMotorControl2(self.robotId, 9, p.POSITION_CONTROL, targetPosition=width, force=60)
         p.setJointMotorControl2(self.robotId, 10, p.POSITION_CONTROL, targetPosition=width, force=60)
-        time.sleep(0.2)
 
-    def rotate_wrist(self, angle_deg, steps=100, delay=0.01):
-        """旋转手腕（Joint 6）指定角度"""
-        if self.robotId is None:
-            return
+        # 等待夹爪稳定
+        for _ in range(settle_steps):
+            yield
 
+    def rotate_wrist_ticks(self, angle_deg, steps=100):
+        """逐周期生成手腕旋转指令"""
         # 获取当前关节角度
         start_joints = self.get_current_joint_angles()
         target_joints = list(start_joints)
@@ -108,13 +305,51 @@ class RobotController:
                 angle = start_joints[i] + (target_joints[i] - start_joints[i]) * t
                 current_command.append(angle)
 
-            for i in range(7):
-                p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=current_command[i], force=200)
-            time.sleep(delay)
+            self._command_joints(current_command)
+            yield
 
         # 锁定位置
-        for i in range(7):
-            p.setJointMotorControl2(self.robotId, i, p.POSITION_CONTROL, targetPosition=target_joints[i], force=200)
+        self._command_joints(target_joints)
+
+    def hold(self):
+        """在当前位置锁定所有关节（用于取消动作后停住）"""
+        if self.robotId is None:
+            return
+        self._command_joints(self.get_current_joint_angles())
+
+    def move_to_smooth(self, target_pos, steps=100, delay=0.01):
+        """平滑移动到目标位置（带零空间约束和高精度IK）"""
+        if self.robotId is None:
+            return
+        self._run_ticks(self.move_ticks(target_pos, steps), delay)
+
+    def move_through(self, targets, steps=150, blend_radius=0.05, delay=0.01):
+        """连续经过多个目标点，途经点处按融合半径平滑过渡而不停顿
+
+        与货架之间的水平进退段（仅 Y 变化）两端不做融合，保证严格沿 Y 轴接近瓶子。
+        """
+        if self.robotId is None or not targets:
+            return
+        self._run_ticks(self.move_through_ticks(targets, steps, blend_radius), delay)
+
+    def grab(self, width=0.0, steps=50, delay=0.01):
+        """平滑抓取/释放（控制夹爪开合）"""
+        if self.robotId is None:
+            return
+        self._run_ticks(self.grab_ticks(width, steps, settle_steps=0), delay)
+        time.sleep(0.2)
+
+    def rotate_wrist(self, angle_deg, steps=100, delay=0.01):
+        """旋转手腕（Joint 6）指定角度"""
+        if self.robotId is None:
+            return
+        self._run_ticks(self.rotate_wrist_ticks(angle_deg, steps), delay)
+
+    def get_end_effector_pos(self):
+        """获取末端执行器当前的世界坐标"""
+        if self.robotId is None:
+            return [0, 0, 0]
+        return list(p.getLinkState(self.robotId, self.end_effector_index)[4])
 
     def get_current_joint_angles(self):
         """获取机械臂当前7个关节的角度"""
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+import numpy as np
+
+TELEMETRY_VERSION = 1
+
+# 每个控制周期一条记录，定长二进制，可直接 np.memmap
+TICK_DTYPE = np.dtype([
+    ("t", "<f8"),              # 距会话开始的秒数
+    ("cmd_q", "<f4", (7,)),    # 指令关节角
+    ("meas_q", "<f4", (7,)),   # 实测关节角
+    ("gripper", "<f4"),        # 夹爪开口（两指之和）
+    ("ee_pos", "<f4", (3,)),   # 末端位置
+    ("ee_orn", "<f4", (4,)),   # 末端姿态四元数
+])
+
+SEGMENT_DTYPE = np.dtype([
+    ("label", "<U64"),
+    ("start", "<i8"),
+    ("stop", "<i8"),
+    ("t_start", "<f8"),
+    ("t_end", "<f8"),
+])
+
+
+class TelemetryRecorder:
+    """轨迹记录器：每个控制周期写入预分配的缓冲区，满了再追加到二进制文件
+
+    会话由两个文件组成：<path>.ticks（TICK_DTYPE 定长记录）和
+    <path>.index.npz（版本号 + 每个订单的分段索引）。
+    """
+
+    def __init__(self, path, capacity=4096):
+        self.path = path
+        self.ticks_path = f"{path}.ticks"
+        self.index_path = f"{path}.index.npz"
+        self.buffer = np.zeros(capacity, dtype=TICK_DTYPE)
+        self.count = 0           # 缓冲区中的条数
+        self.flushed = 0         # 已写入文件的条数
+        self.segments = []
+        self._open_segment = None
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.ticks_path)), exist_ok=True)
+        self._file = open(self.ticks_path, "wb")
+
+    @property
+    def total(self):
+        return self.flushed + self.count
+
+    def record(self, cmd_q, meas_q, gripper, ee_pos, ee_orn):
+        """记录一个控制周期（热路径：只写缓冲区，不打印）"""
+        with self._lock:
+            row = self.buffer[self.count]
+            row["t"] = time.monotonic() - self._t0
+            row["cmd_q"] = cmd_q
+            row["meas_q"] = meas_q
+            row["gripper"] = gripper
+            row["ee_pos"] = ee_pos
+            row["ee_orn"] = ee_orn
+            self.count += 1
+            if self.count == len(self.buffer):
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self.count:
+            self.buffer[:self.count].tofile(self._file)
+            self._file.flush()
+            self.flushed += self.count
+            self.count = 0
+
+    def flush(self):
+        """把缓冲区写入文件并更新索引"""
+        with self._lock:
+            self._flush_locked()
+            self._save_index_locked()
+
+    def begin_segment(self, label):
+        """开始一个分段（通常对应一个订单）"""
+        with self._lock:
+            if self._open_segment is not None:
+                self._close_segment_locked()
+            self._open_segment = (str(label)[:64], self.total, time.monotonic() - self._t0)
+
+    def end_segment(self):
+        """结束当前分段并写盘"""
+        with self._lock:
+            if self._open_segment is not None:
+                self._close_segment_locked()
+            self._flush_locked()
+            self._save_index_locked()
+
+    def _close_segment_locked(self):
+        label, start, t_start = self._open_segment
+        self.segments.append((label, start, self.total, t_start, time.monotonic() - self._t0))
+        self._open_segment = None
+
+    def _save_index_locked(self):
+        segments = np.array(self.segments, dtype=SEGMENT_DTYPE)
+        tmp_path = f"{self.index_path}.tmp.npz"
+        np.savez(tmp_path, version=np.array(TELEMETRY_VERSION), ticks=np.array(self.flushed), segments=segments)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        """结束未关闭的分段，写盘并关闭文件"""
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._open_segment is not None:
+                self._close_segment_locked()
+            self._flush_locked()
+            self._save_index_locked()
+            self._file.close()
+
+
+class TelemetrySession:
+    """读取一次记录会话：tick 数据以 memmap 方式按需访问，无需解析文本"""
+
+    def __init__(self, path):
+        with np.load(f"{path}.index.npz") as index:
+            version = int(index["version"])
+            if version != TELEMETRY_VERSION:
+                raise ValueError(f"不支持的记录版本: {version}")
+            self.segments = index["segments"]
+            count = int(index["ticks"])
+
+        self.ticks = np.memmap(f"{path}.ticks", dtype=TICK_DTYPE, mode="r", shape=(count,)) if count else \
+            np.zeros(0, dtype=TICK_DTYPE)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def labels(self):
+        return [str(label) for label in self.segments["label"]]
+
+    def segment(self, key):
+        """按序号或标签取出一个分段的 tick 数据"""
+        if isinstance(key, str):
+            matches = np.nonzero(self.segments["label"] == key)[0]
+            if len(matches) == 0:
+                raise KeyError(key)
+            key = matches[-1]
+        seg = self.segments[key]
+        return self.ticks[seg["start"]:seg["stop"]]
+
+    def summary(self):
+        """每个分段的耗时、周期数和最大关节跟踪误差"""
+        rows = []
+        for i, seg in enumerate(self.segments):
+            data = self.segment(i)
+            error = float(np.abs(data["cmd_q"] - data["meas_q"]).max()) if len(data) else 0.0
+            rows.append({
+                "label": str(seg["label"]),
+                "ticks": int(seg["stop"] - seg["start"]),
+                "duration_s": float(seg["t_end"] - seg["t_start"]),
+                "max_tracking_error_rad": error,
+            })
+        return rows
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    if len(sys.argv) < 2:
+        print("用法: python telemetry.py <会话路径>")
+    else:
+        session = TelemetrySession(sys.argv[1])
+        print(f"共 {len(session)} 个控制周期，{len(session.segments)} 个分段")
+        print(json.dumps(session.summary(), indent=2, ensure_ascii=False))
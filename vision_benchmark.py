@@ -0,0 +1,221 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from output_validator import INGREDIENTS, DEFAULT_LAYOUT, GRID_SIZE
+
+# 货架包围盒（世界坐标，与 coffee_env.py 一致），用于计算 "shelf" 裁剪框
+SHELF_BOUNDS = [[-0.3, 0.04, 0.75], [0.3, 0.16, 1.17]]
+
+# 裁剪方式 -> 包围盒外扩边距（米）；None 表示整张图
+CROPS = {"full": None, "shelf": 0.03}
+
+
+def sample_layouts(count, seed=0):
+    """生成 count 个不重复的货架布局 {原料: [row, col]}，第一个总是初始布局"""
+    rng = random.Random(seed)
+    cells = [[i // GRID_SIZE, i % GRID_SIZE] for i in range(GRID_SIZE * GRID_SIZE)]
+    layouts, seen = [dict(DEFAULT_LAYOUT)], {tuple(INGREDIENTS)}
+    limit = math.factorial(len(INGREDIENTS))
+
+    while len(layouts) < min(count, limit):
+        order = INGREDIENTS[:]
+        rng.shuffle(order)
+        if tuple(order) in seen:
+            continue
+        seen.add(tuple(order))
+        layouts.append({name: cell for name, cell in zip(order, cells)})
+    return layouts
+
+
+def shelf_crop_box(camera, margin):
+    """把货架包围盒投影到最近一次拍摄的图像上，返回像素裁剪框 (left, top, right, bottom)"""
+    (x0, y0, z0), (x1, y1, z1) = SHELF_BOUNDS
+    corners = [[x, y, z] for x in (x0 - margin, x1 + margin)
+               for y in (y0, y1) for z in (z0 - margin, z1 + margin)]
+    uv = camera.project(corners)
+    cap = camera.last_capture
+    left, top = np.floor(uv.min(axis=0)).astype(int)
+    right, bottom = np.ceil(uv.max(axis=0)).astype(int)
+    return max(left, 0), max(top, 0), min(right, cap["width"]), min(bottom, cap["height"])
+
+
+def capture_dataset(layouts, resolutions, crops, out_dir):
+    """无窗口启动场景，按每个布局摆好瓶子并拍照，返回样本列表"""
+    from matplotlib import image as mpimg
+    from coffee_env import CoffeeShopServer
+    from camera_manager import CameraManager
+
+    os.makedirs(out_dir, exist_ok=True)
+    server = CoffeeShopServer(headless=True)
+    samples = []
+
+    for layout_idx, layout in enumerate(layouts):
+        truth = server.apply_layout(layout)
+        for resolution in resolutions:
+            camera = CameraManager(save_path=os.path.join(out_dir, "_raw.png"), resolution=resolution)
+            if not camera.capture_image():
+                continue
+            rgb = camera.last_capture["rgb"]
+
+            for crop in crops:
+                image = rgb
+                if CROPS[crop] is not None:
+                    left, top, right, bottom = shelf_crop_box(camera, CROPS[crop])
+                    image = rgb[top:bottom, left:right]
+
+                path = os.path.join(out_dir, f"layout{layout_idx:03d}_{resolution}_{crop}.png")
+                mpimg.imsave(path, image)
+                png_bytes = os.path.getsize(path)
+                samples.append({
+                    "layout": layout_idx,
+                    "resolution": resolution,
+                    "crop": crop,
+                    "image_size": [int(image.shape[1]), int(image.shape[0])],
+                    "path": path,
+                    "truth": truth,
+                    "png_bytes": png_bytes,
+                    "request_bytes": 4 * math.ceil(png_bytes / 3),  # Base64 编码后的图片大小
+                })
+
+    os.remove(os.path.join(out_dir, "_raw.png"))
+    return samples
+
+
+def build_backends(models):
+    """创建可用的视觉后端，缺少 API Key 等无法创建的后端会被跳过"""
+    from vision_llm import VisionLLM
+
+    backends = {}
+    for model in models:
+        try:
+            backends[model] = VisionLLM(model=model)
+        except Exception as e:
+            print(f"⚠️ 跳过视觉后端 {model}: {e}")
+    return backends
+
+
+def _run_sample(name, backend, sample):
+    """对单个样本做一次识别，记录耗时和逐个原料的对错"""
+    start = time.perf_counter()
+    try:
+        result = backend.detect_ingredients(sample["path"]) or {}
+    except Exception as e:
+        print(f"❌ {name} 识别异常: {e}")
+        result = {}
+    latency = time.perf_counter() - start
+
+    truth = sample["truth"]
+    return {
+        "backend": name,
+        "layout": sample["layout"],
+        "resolution": sample["resolution"],
+        "crop": sample["crop"],
+        "request_bytes": sample["request_bytes"],
+        "latency_s": latency,
+        "failed": not result,
+        "correct": {item: list(result.get(item) or []) == list(truth[item]) for item in INGREDIENTS},
+        "truth": truth,
+    }
+
+
+def evaluate(backends, samples, workers=4):
+    """并行地用每个后端识别每个样本"""
+    jobs = [(name, backend, sample) for name, backend in backends.items() for sample in samples]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda job: _run_sample(*job), jobs))
+
+
+def summarize(records):
+    """按 (后端, 分辨率, 裁剪) 汇总准确率、延迟分位数和请求大小"""
+    groups = {}
+    for record in records:
+        groups.setdefault((record["backend"], record["resolution"], record["crop"]), []).append(record)
+
+    summary = []
+    for (backend, resolution, crop), group in sorted(groups.items()):
+        latencies = np.array([r["latency_s"] for r in group])
+        per_item = {item: float(np.mean([r["correct"][item] for r in group])) for item in INGREDIENTS}
+
+        # 按真实所在格子统计：哪些位置更容易认错
+        per_cell = np.zeros((GRID_SIZE, GRID_SIZE))
+        for r in group:
+            for item, ok in r["correct"].items():
+                row, col = r["truth"][item]
+                per_cell[row][col] += ok
+        per_cell /= len(group)
+
+        summary.append({
+            "backend": backend,
+            "resolution": resolution,
+            "crop": crop,
+            "samples": len(group),
+            "accuracy": float(np.mean(list(per_item.values()))),
+            "layout_accuracy": float(np.mean([all(r["correct"].values()) for r in group])),
+            "failure_rate": float(np.mean([r["failed"] for r in group])),
+            "latency_p50_s": float(np.percentile(latencies, 50)),
+            "latency_p90_s": float(np.percentile(latencies, 90)),
+            "latency_p99_s": float(np.percentile(latencies, 99)),
+            "request_kb": float(np.mean([r["request_bytes"] for r in group]) / 1024),
+            "per_cell": per_cell.round(3).tolist(),
+            "per_ingredient": {k: round(v, 3) for k, v in per_item.items()},
+        })
+    return summary
+
+
+def print_report(summary):
+    print("\n" + "=" * 86)
+    # 中文字符占两列，表头宽度相应减小
+    print(f"{'后端':<18}{'分辨率':>6}{'裁剪':>6}{'样本':>4}{'准确率':>7}{'整单':>7}"
+          f"{'p50(s)':>8}{'p90(s)':>8}{'p99(s)':>8}{'请求KB':>7}")
+    print("-" * 86)
+    for s in summary:
+        print(f"{s['backend']:<20}{s['resolution']:>6}{s['crop']:>8}{s['samples']:>6}"
+              f"{s['accuracy']:>10.1%}{s['layout_accuracy']:>9.1%}"
+              f"{s['latency_p50_s']:>8.2f}{s['latency_p90_s']:>8.2f}{s['latency_p99_s']:>8.2f}"
+              f"{s['request_kb']:>9.1f}")
+
+    for s in summary:
+        print(f"\n📊 {s['backend']} @ {s['resolution']}px / {s['crop']}")
+        print("   各格子准确率 (row 0 在最下方):")
+        for row in reversed(range(GRID_SIZE)):
+            print("   " + "  ".join(f"{v:6.1%}" for v in s["per_cell"][row]))
+        worst = sorted(s["per_ingredient"].items(), key=lambda kv: kv[1])[:3]
+        print("   最易认错: " + ", ".join(f"{k} {v:.0%}" for k, v in worst))
+
+
+if __name__ == "__main__":
+    # 用法: python vision_benchmark.py --layouts 20 --resolutions 320 640 --crops full shelf
+    parser = argparse.ArgumentParser(description="视觉识别准确率 / 延迟基准测试")
+    parser.add_argument("--layouts", type=int, default=10, help="随机货架布局数量（含初始布局）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[640])
+    parser.add_argument("--crops", nargs="+", default=["full"], choices=list(CROPS))
+    parser.add_argument("--models", nargs="+", default=["glm-4.6v-flash"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--out", default="vision_benchmark")
+    args = parser.parse_args()
+
+    layouts = sample_layouts(args.layouts, args.seed)
+    samples = capture_dataset(layouts, args.resolutions, args.crops, args.out)
+    print(f"📷 已生成 {len(samples)} 张测试图片 ({len(layouts)} 个布局)")
+
+    backends = build_backends(args.models)
+    if not backends:
+        print("❌ 没有可用的视觉后端")
+        raise SystemExit(1)
+
+    records = evaluate(backends, samples, args.workers)
+    summary = summarize(records)
+    print_report(summary)
+
+    report_path = os.path.join(args.out, "report.json")
+    with open(report_path, "w") as f:
+        json.dump({"args": vars(args), "summary": summary, "records": records}, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ 详细结果已保存至: {report_path}")
@@ -1,12 +1,12 @@
 import os
 import json
 import base64
+import hashlib
 import mimetypes
 from pathlib import Path
-from zai import ZhipuAiClient
-from dotenv import load_dotenv
-
-load_dotenv()
+from model_client import ModelBackend, get_api_key
+from output_validator import OutputValidationError, parse_json, normalize_ingredient, validate_location_map
+from request_coalescer import RequestCoalescer
 
 # 视觉专家的核心知识库
 INGREDIENT_FEATURES = """
@@ -46,14 +46,17 @@ SYSTEM_PROMPT = f"""
 }}
 """
 
-class VisionLLM:
+class VisionLLM(ModelBackend):
     """视觉识别器：基于 VLM 识别图像中的原料位置"""
 
-    def __init__(self):
-        self.api_key = os.getenv("ZHIPUAI_API_KEY")
+    def __init__(self, model="glm-4.6v-flash", wait_timeout=90):
+        self.api_key = get_api_key()
         if not self.api_key:
             raise ValueError("❌ 错误：未设置 ZHIPUAI_API_KEY")
-        self.client = ZhipuAiClient(api_key=self.api_key)
+        self.model = model
+
+        # 同一帧图像的并发识别只调用一次 VLM
+        self.coalescer = RequestCoalescer(timeout=wait_timeout)
 
     def _encode_image(self, image_path):
         """将图像编码为 Base64"""
@@ -66,6 +69,39 @@ class VisionLLM:
             base64_data = base64.b64encode(image_file.read()).decode('utf-8')
         return f"data:{mime_type};base64,{base64_data}"
 
+    def _ask(self, prompt, base64_url):
+        """发送图文请求并返回原始文本"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": base64_url}}
+                    ]
+                }
+            ],
+            temperature=0.1,
+            top_p=0.5,
+        )
+        return response.choices[0].message.content
+
+    def _check(self, content):
+        """本地修复并校验位置地图，返回 (合法条目, 需要重问的原料, 错误列表)"""
+        try:
+            raw = parse_json(content, "{")
+        except OutputValidationError as e:
+            return {}, [], e.errors
+        location_map, errors = validate_location_map(raw)
+        invalid = []
+        if isinstance(raw, dict):
+            for key in raw:
+                name = normalize_ingredient(key)
+                if name and name not in location_map and name not in invalid:
+                    invalid.append(name)
+        return location_map, invalid, errors
+
     def detect_ingredients(self, image_path_str: str):
         """识别图像中的原料位置"""
         print(f"👁️ 视觉感知中...")
@@ -76,35 +112,42 @@ class VisionLLM:
             return None
 
         try:
-            response = self.client.chat.completions.create(
-                model="glm-4.6v-flash",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": SYSTEM_PROMPT},
-                            {"type": "image_url", "image_url": {"url": base64_url}}
-                        ]
-                    }
-                ],
-                temperature=0.1,
-                top_p=0.5,
+            image_key = hashlib.md5(base64_url.encode("utf-8")).hexdigest()
+            location_map = self.coalescer.run(
+                self.coalescer.make_key(self.model, image_key), lambda: self._detect(base64_url)
             )
-
-            content = response.choices[0].message.content
-
-            # 清理 Markdown 代码块
-            if "```" in content:
-                content = content.replace("```json", "").replace("```", "")
-
-            location_map = json.loads(content)
             print("✅ 视觉识别成功")
             return location_map
 
+        except TimeoutError:
+            print("❌ 视觉识别失败: 等待识别结果超时")
+            return None
         except Exception as e:
             print(f"❌ 视觉识别失败: {e}")
             return None
 
+    def _detect(self, base64_url):
+        """调用 VLM 识别位置地图，出错的原料重问一次，没有任何合法坐标时抛出 OutputValidationError"""
+        location_map, invalid, errors = self._check(self._ask(SYSTEM_PROMPT, base64_url))
+
+        # 只针对出错的原料重问一次，合法条目直接保留
+        if errors:
+            print(f"⚠️ 视觉结果校验未通过，重新询问: {errors}")
+            focus = f"本次只需要输出这些原料的坐标: {invalid}。" if invalid and location_map else ""
+            reask = f"{SYSTEM_PROMPT}\n上一次的输出存在问题: {errors}。{focus}"
+            fixed_map, _, fixed_errors = self._check(self._ask(reask, base64_url))
+            taken = {tuple(v) for v in location_map.values()}
+            for name, cell in fixed_map.items():
+                if name not in location_map and tuple(cell) not in taken:
+                    location_map[name] = cell
+                    taken.add(tuple(cell))
+            if fixed_errors:
+                print(f"⚠️ 部分条目仍不合法，已丢弃: {fixed_errors}")
+
+        if not location_map:
+            raise OutputValidationError(["没有合法的坐标"])
+        return location_map
+
 if __name__ == "__main__":
     eye = VisionLLM()
     image_file = "captured_scene.png"